@@ -26,7 +26,9 @@ class Model:
     @classmethod
     def bulk_update(cls, model_list: Iterable[T], fields: List[Any], batch_size: int) -> None: ...
     @classmethod
-    def select(cls) -> Any: ...
+    def table_exists(cls) -> bool: ...
+    @classmethod
+    def select(cls, *fields: Any) -> Any: ...
     @classmethod
     def update(cls, **kwargs: Any) -> Any: ...
 
@@ -34,6 +36,10 @@ class Model:
     def raw(cls, sql: str, *args: Any) -> Iterable[T]:
         ...
 
+def Value(value: Any) -> Any: ...
+
+fn: Any
+
 class SqliteDatabase:
     def __init__(self, *args: Any, **kwargs: Any) -> None: ...
     def init(self, *args: Any) -> None: ...
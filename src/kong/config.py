@@ -15,6 +15,12 @@ import yaml
 from schema import And, Optional, Schema, Use
 import notifiers  # type: ignore
 
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader as YamlLoader  # type: ignore
+    from yaml import SafeDumper as YamlDumper  # type: ignore # noqa: F401
+
 
 APP_NAME = "kong"
 APP_DIR = click.get_app_dir(APP_NAME, force_posix=True)
@@ -191,7 +197,7 @@ class Config:
             self.data = data
         else:
             with open(CONFIG_FILE) as f:
-                self.data = yaml.safe_load(f)
+                self.data = yaml.load(f, Loader=YamlLoader)
 
         self.data = config_schema.validate(self.data)
 
@@ -1,7 +1,7 @@
 """
 Singleton database instance
 """
-from typing import TYPE_CHECKING, Any, List, ContextManager, Tuple, Iterable
+from typing import TYPE_CHECKING, Any, List, ContextManager, Tuple, Iterable, Sequence
 
 if not TYPE_CHECKING:
     from playhouse.sqlite_ext import SqliteExtDatabase, AutoIncrementField
@@ -19,10 +19,11 @@ else:  # pragma: no cover
             """
             ...
 
-        def init(self, *args: Any) -> None:
+        def init(self, *args: Any, **kwargs: Any) -> None:
             """
             Type stub
             :param args:
+            :param kwargs:
             :return:
             """
             ...
@@ -42,6 +43,13 @@ else:  # pragma: no cover
             """
             ...
 
+        def connection(self) -> Any:
+            """
+            Type stub
+            :return:
+            """
+            ...
+
         def atomic(self) -> ContextManager[None]:
             """
             Type stub
@@ -49,7 +57,9 @@ else:  # pragma: no cover
             """
             ...
 
-        def execute_sql(self, query: str, params: Tuple[Any]) -> Iterable[Tuple[Any]]:
+        def execute_sql(
+            self, query: str, params: Sequence[Any]
+        ) -> Iterable[Tuple[Any]]:
             ...
 
     class AutoIncrementField:
@@ -60,4 +70,18 @@ else:  # pragma: no cover
         ...
 
 
+# Applied to every connection. The recursive CTEs materialize their work
+# tables as temporary tables, keep those and hot pages in memory.
+# WAL is not enabled on purpose: the database usually lives in the home
+# directory, which is often a network file system (AFS/NFS) on clusters,
+# where WAL's shared memory index does not work.
+pragmas = {
+    "temp_store": "memory",
+    "cache_size": -64 * 1024,  # in KiB
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+# Size of sqlite3's per-connection cache of prepared statements (default 100)
+cached_statements = 256
+
 database = SqliteExtDatabase(None)
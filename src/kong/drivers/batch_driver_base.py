@@ -25,6 +25,9 @@ from ..executor import SerialExecutor
 from ..model.job import Job
 from ..db import database
 
+# bound once, avoids the attribute lookups in the bulk code paths
+_utcnow = datetime.datetime.utcnow
+
 
 class BatchDriverBase(DriverBase):
     def bulk_create_jobs(self, jobs: Iterable[Dict[str, Any]]) -> List["Job"]:
@@ -33,17 +36,42 @@ class BatchDriverBase(DriverBase):
     def sync_status(self, job: "Job") -> Job:
         return self.bulk_sync_status([job])[0]
 
-    def bulk_kill(self, jobs: Sequence["Job"]) -> Sequence["Job"]:
-        now = datetime.datetime.utcnow()
+    def bulk_kill(
+        self, jobs: Sequence["Job"], ex: Executor = SerialExecutor()
+    ) -> Sequence["Job"]:
+        now = _utcnow()
         jobs = self.bulk_sync_status(jobs)
 
-        for job in jobs:
+        def run(job: Job) -> Job:
+            # one batch system call per job, these can run concurrently
             self.kill(job, save=False)
             job.updated_at = now
-            job.save()
+            return job
+
+        futures = [ex.submit(run, job) for job in jobs]
+
+        killed: List[Job] = []
+        error: Optional[Exception] = None
+        for f in as_completed(futures):
+            try:
+                killed.append(f.result())
+            except Exception as e:
+                if error is None:
+                    error = e
+
+        # persist whatever was killed, even if another kill failed
+        self._bulk_save(killed, [Job.status, Job.updated_at])
+        if error is not None:
+            raise error
 
         return jobs
 
+    def _bulk_save(self, jobs: List["Job"], fields: List[Any]) -> None:
+        if len(jobs) == 0:
+            return
+        with database.atomic():
+            Job.bulk_update(jobs, fields=fields, batch_size=self.batch_size)
+
     def wait_gen(
         self,
         job: Union["Job", List["Job"]],
@@ -96,13 +124,20 @@ class BatchDriverBase(DriverBase):
             time.sleep(poll_interval)
 
     def bulk_submit(self, jobs: Iterable["Job"]) -> None:
-        now = datetime.datetime.utcnow()
+        now = _utcnow()
 
-        for job in jobs:
-            assert job.driver == self.__class__, "Not valid for different driver"
-            self.submit(job, save=False)
-            job.updated_at = now
-            job.save()
+        submitted: List[Job] = []
+        try:
+            for job in jobs:
+                assert job.driver == self.__class__, "Not valid for different driver"
+                self.submit(job, save=False)
+                job.updated_at = now
+                submitted.append(job)
+        finally:
+            # jobs that made it to the batch system need their batch job id stored
+            self._bulk_save(
+                submitted, [Job.status, Job.batch_job_id, Job.data, Job.updated_at]
+            )
 
     @checked_job  # type: ignore
     @contextmanager  # type: ignore
@@ -198,16 +233,15 @@ class BatchDriverBase(DriverBase):
         with database.atomic():
 
             with database.atomic():
-                now = datetime.datetime.utcnow()
 
-                def jobit() -> Iterable[Job]:
+                def jobit(now: datetime.datetime) -> Iterable[Job]:
                     for job in jobs:
                         job.status = Job.Status.CREATED
                         job.updated_at = now
                         yield job
 
                 Job.bulk_update(
-                    jobit(),
+                    jobit(_utcnow()),
                     fields=[Job.status, Job.updated_at],
                     batch_size=self.batch_size,
                 )
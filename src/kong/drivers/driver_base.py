@@ -82,7 +82,9 @@ class DriverBase(ABC):  # pragma: no-cover
         raise NotImplementedError()
 
     @abstractmethod
-    def bulk_kill(self, jobs: Sequence["Job"]) -> Sequence["Job"]:
+    def bulk_kill(
+        self, jobs: Sequence["Job"], ex: Executor = SerialExecutor()
+    ) -> Sequence["Job"]:
         raise NotImplementedError()
 
     @abstractmethod
@@ -122,8 +122,9 @@ class LocalDriver(DriverBase):
         return job
 
     def bulk_create_jobs(self, jobs: Iterable[Dict[str, Any]]) -> List["Job"]:
-        # right now, implemented as loop, potential to optimize
-        return [self.create_job(**kwargs) for kwargs in jobs]
+        # one transaction for all jobs, instead of one commit per job
+        with database.atomic():
+            return [self.create_job(**kwargs) for kwargs in jobs]
 
     def cleanup(self, job: Job) -> Job:
         if job.status not in (
@@ -264,7 +265,11 @@ class LocalDriver(DriverBase):
         if save:
             job.save()
 
-    def bulk_kill(self, jobs: Sequence["Job"]) -> Sequence[Job]:
+    def bulk_kill(
+        self, jobs: Sequence["Job"], ex: Executor = SerialExecutor()
+    ) -> Sequence[Job]:
+        # killing local processes is quick, and status syncs read from the
+        # database, so this always runs serially
         now = datetime.datetime.utcnow()
 
         def k() -> Iterable[Job]:
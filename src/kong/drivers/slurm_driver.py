@@ -1,7 +1,9 @@
+import csv
 import datetime
 import os
 import re
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 from typing import (
     Iterator,
@@ -14,19 +16,26 @@ from typing import (
     Collection,
     Dict,
     Any,
+    Tuple,
 )
 
-import sh
 from jinja2 import Environment, DictLoader
 
-from kong.drivers.batch_driver_base import BatchDriverBase
+from kong.drivers.batch_driver_base import BatchDriverBase, _utcnow
 from ..drivers import InvalidJobStatus
 from ..logger import logger
 from ..config import Config
 from ..db import database
 from ..model.job import Job
 from ..model.folder import Folder
-from ..util import make_executable, format_timedelta, parse_timedelta
+from ..util import (
+    make_executable,
+    format_timedelta,
+    parse_timedelta,
+    ensure_dir,
+    ShellCommand,
+    exhaust,
+)
 from .driver_base import checked_job
 
 
@@ -92,16 +101,16 @@ class SlurmInterface(ABC):
 
 
 class ShellSlurmInterface(SlurmInterface):
-    _sacct: Optional[sh.Command] = None
-    _sbatch: Optional[sh.Command] = None
-    _scancel: Optional[sh.Command] = None
+    _sacct: Optional[ShellCommand] = None
+    _sbatch: Optional[ShellCommand] = None
+    _scancel: Optional[ShellCommand] = None
 
     subreg = re.compile(r".* (\d*)$")
 
     def __init__(self) -> None:  # pragma: no cover
-        self._sacct = sh.Command("sacct")
-        self._sbatch = sh.Command("sbatch")
-        self._scancel = sh.Command("scancel")
+        self._sacct = ShellCommand("sacct")
+        self._sbatch = ShellCommand("sbatch")
+        self._scancel = ShellCommand("scancel")
 
     def sacct(
         self, jobs: Collection["Job"], start_delta: timedelta
@@ -112,7 +121,7 @@ class ShellSlurmInterface(SlurmInterface):
 
         fields = ["JobID", "State", "ExitCode", "Submit", "Start", "End", "NodeList"]
 
-        args = dict(
+        args: Dict[str, Any] = dict(
             format=",".join(fields),
             noheader=True,
             parsable2=True,
@@ -133,12 +142,11 @@ class ShellSlurmInterface(SlurmInterface):
             logger.debug("Job argument: %s", job_ids)
 
         assert self._sacct is not None
-        for line in self._sacct(**args):
-            data = dict(zip(fields, line.split("|")))
-            job_id = data["JobID"]
-            status = data["State"]
-            exit = data["ExitCode"]
-            # job_id, status, exit = line.split("|", 3)
+        rows = csv.reader(self._sacct(**args), delimiter="|", quoting=csv.QUOTE_NONE)
+        for row in rows:
+            if len(row) != len(fields):
+                continue
+            job_id, status, exit, submit, start, end, node = row
             if not job_id.isdigit():
                 continue
             yield SlurmAccountingItem.from_parts(
@@ -146,10 +154,10 @@ class ShellSlurmInterface(SlurmInterface):
                 status,
                 exit,
                 other=dict(
-                    node=data["NodeList"] if data["NodeList"] != "" else None,
-                    submit=data["Submit"] if data["Submit"] != "" else None,
-                    start=data["Start"] if data["Start"] != "" else None,
-                    end=data["End"] if data["End"] != "" else None,
+                    node=node if node != "" else None,
+                    submit=submit if submit != "" else None,
+                    start=start if start != "" else None,
+                    end=end if end != "" else None,
                 ),
             )
 
@@ -220,6 +228,9 @@ class SlurmDriver(BatchDriverBase):
         super().__init__(config)
         self.slurm_config = self.config.data["slurm_driver"]
 
+        os.makedirs(self.config.jobdir, exist_ok=True)
+        os.makedirs(self.config.joboutputdir, exist_ok=True)
+
     def create_job(
         self,
         folder: "Folder",
@@ -233,10 +244,6 @@ class SlurmDriver(BatchDriverBase):
         walltime: Union[timedelta, str] = timedelta(minutes=30),
         licenses: Optional[str] = None,
     ) -> "Job":
-
-        if queue is None:
-            queue = self.slurm_config["default_queue"]
-
         job: Job = Job.create(
             folder=folder,
             batch_job_id=None,  # don't have one until submission
@@ -245,22 +252,91 @@ class SlurmDriver(BatchDriverBase):
             cores=cores,
             memory=memory,
         )
+        values = self._prepare_job(
+            job,
+            nnodes=nnodes,
+            ntasks=ntasks,
+            queue=queue,
+            name=name,
+            walltime=walltime,
+            licenses=licenses,
+        )
+        job.save()
+        self._write_job_files(values)
+        return job
+
+    def bulk_create_jobs(self, jobs: Iterable[Dict[str, Any]]) -> List["Job"]:
+        jobs = list(jobs)
+        row_fields = ("folder", "command", "cores", "memory")
+        rows = [
+            dict(
+                {k: v for k, v in kwargs.items() if k in row_fields},
+                batch_job_id=None,  # don't have one until submission
+                driver=self.__class__,
+            )
+            for kwargs in jobs
+        ]
+
+        with database.atomic():
+            ids = Job.bulk_insert(rows)
+            by_id: Dict[int, Job] = {
+                j.job_id: j for j in Job.bulk_select(Job.job_id, ids)
+            }
+            assert len(by_id) == len(rows), "Inserted jobs could not be selected"
+            created = [by_id[i] for i in ids]
+
+            all_values = [
+                self._prepare_job(
+                    job, **{k: v for k, v in kwargs.items() if k not in row_fields}
+                )
+                for job, kwargs in zip(created, jobs)
+            ]
+            Job.bulk_update(created, fields=[Job.data], batch_size=self.batch_size)
+
+        # writing the job files is pure I/O, overlap it
+        nthreads = 40
+        logger.debug("Writing job files on %d threads", nthreads)
+        with ThreadPoolExecutor(nthreads) as ex:
+            exhaust(ex.map(self._write_job_files, all_values))
+
+        return created
+
+    def _prepare_job(
+        self,
+        job: "Job",
+        nnodes: int = 1,
+        ntasks: int = 1,
+        queue: Optional[str] = None,
+        name: Optional[str] = None,
+        walltime: Union[timedelta, str] = timedelta(minutes=30),
+        licenses: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Set up directories and the data of a job that exists in the database,
+        without saving it.
+
+        :return: Values to render the job files with
+        """
+
+        if queue is None:
+            queue = self.slurm_config["default_queue"]
 
         if name is None:
             name = f"kong_job_{job.job_id}"
 
         # in job dir, create output dir
         output_dir = self.make_output_path(job)
-        os.makedirs(output_dir, exist_ok=True)
+        ensure_dir(output_dir)
 
         log_dir = self.make_log_path(job)
-        os.makedirs(log_dir, exist_ok=True)
+        ensure_dir(log_dir)
 
-        stdout = os.path.abspath(os.path.join(log_dir, "stdout.txt"))
-        slurm_out = os.path.abspath(os.path.join(log_dir, "slurm_out.txt"))
+        # log_dir is absolute and normalized already
+        stdout = f"{log_dir}/stdout.txt"
+        slurm_out = f"{log_dir}/slurm_out.txt"
 
-        batchfile = os.path.join(log_dir, "batchfile.sh")
-        jobscript = os.path.join(log_dir, "jobscript.sh")
+        batchfile = f"{log_dir}/batchfile.sh"
+        jobscript = f"{log_dir}/jobscript.sh"
 
         if isinstance(walltime, str):
             norm_walltime = format_timedelta(parse_timedelta(walltime))
@@ -285,21 +361,20 @@ class SlurmDriver(BatchDriverBase):
             account=self.config.slurm_driver["account"],
             licenses=licenses,
         )
-        job.save()
 
         values = dict(
             batchfile=batchfile,
             jobscript=jobscript,
-            command=command,
+            command=job.command,
             stdout=stdout,
             slurm_out=slurm_out,
             internal_job_id=job.job_id,
             log_dir=log_dir,
             output_dir=output_dir,
-            cores=cores,
+            cores=job.cores,
             nnodes=nnodes,
             ntasks=ntasks,
-            memory=memory,
+            memory=job.memory,
             account=self.config.slurm_driver["account"],
             name=name,
             queue=queue,
@@ -307,52 +382,75 @@ class SlurmDriver(BatchDriverBase):
             licenses=licenses,
         )
 
+        job._driver_instance = self
+        return values
+
+    def _write_job_files(self, values: Dict[str, Any]) -> None:
         batchfile_content = batchfile_tpl.render(**values)
 
-        with open(batchfile, "w") as fh:
+        with open(values["batchfile"], "w") as fh:
             fh.write(batchfile_content)
 
         jobscript_content = jobscript_tpl.render(**values)
-        with open(job.data["jobscript"], "w") as fh:
+        with open(values["jobscript"], "w") as fh:
             fh.write(jobscript_content)
 
-        make_executable(job.data["jobscript"])
-
-        job._driver_instance = self
-        return job
+        make_executable(values["jobscript"])
 
     def bulk_sync_status(self, jobs: Collection["Job"]) -> Sequence["Job"]:
+        jobs = list(jobs)
         logger.debug("Bulk sync status with %d jobs", len(jobs))
         for job in jobs:
             self._check_driver(job)
 
-        now = datetime.datetime.utcnow()
+        if all(job.status in (Job.Status.COMPLETED, Job.Status.FAILED) for job in jobs):
+            logger.debug("All jobs in terminal state, no need to query sacct")
+            return jobs
 
-        def proc() -> Iterable[Job]:
+        id_to_job = {str(j.batch_job_id): j for j in jobs if j.batch_job_id is not None}
+
+        def proc(now: datetime.datetime) -> Iterable[Tuple[Job, bool]]:
             job_not_found = 0
             for item in self.slurm.sacct(jobs, self.slurm_config["sacct_delta"]):
-                job = Job.get_or_none(batch_job_id=item.job_id)
+                job = id_to_job.get(str(item.job_id))
                 if job is None:
                     job_not_found += 1
                     continue
+                data_changed = job.data.get("exit_code") != item.exit_code or any(
+                    job.data.get(k) != v for k, v in item.other.items()
+                )
                 job.status = item.status
                 job.data["exit_code"] = item.exit_code
                 job.data.update(item.other)
                 job.updated_at = now
                 assert job.status != Job.Status.CREATED, "Job updated to created?"
-                yield job
+                yield job, data_changed
             if job_not_found > 0:
                 logger.info(
-                    "Tried to fetch %d jobs which where not found in the database",
-                    job_not_found,
+                    "Got %d jobs from sacct which were not requested", job_not_found
                 )
 
+        # only write the data blob for jobs where it actually changed,
+        # re-serializing it is the expensive part of the update
+        data_jobs: List[Job] = []
+        status_jobs: List[Job] = []
+        for job, data_changed in proc(_utcnow()):
+            if data_changed:
+                data_jobs.append(job)
+            else:
+                status_jobs.append(job)
+
         with database.atomic():
             Job.bulk_update(
-                proc(),
+                data_jobs,
                 fields=[Job.data, Job.status, Job.updated_at],
                 batch_size=self.batch_size,
             )
+            Job.bulk_update(
+                status_jobs,
+                fields=[Job.status, Job.updated_at],
+                batch_size=self.batch_size,
+            )
         # reload updated jobs
         ids = [j.job_id for j in jobs]
         logger.debug(
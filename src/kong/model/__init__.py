@@ -1,5 +1,7 @@
 # flake8: noqa
-from typing import Any, List, Iterable, TypeVar
+from typing import Any, Dict, List, Iterable, Optional, TypeVar, Type
+
+import datetime
 
 import peewee as pw
 
@@ -20,9 +22,76 @@ class BaseModel(pw.Model):
             setattr(self, field_name, val)  # type: ignore
         self._dirty.clear()  # type: ignore
 
+    @classmethod
+    def add_missing_columns(cls) -> List[str]:
+        """
+        Add columns to the model's table which are defined on the model, but
+        missing in the database, i.e. for databases created by an older version.
+
+        :return: Names of the columns that were added
+        """
+        if not cls.table_exists():
+            return []
+        table = cls._meta.table_name  # type: ignore
+        columns = cls._meta.database.get_columns(table)  # type: ignore
+        existing = {c.name for c in columns}
+        missing = [
+            field
+            for field in cls._meta.sorted_fields  # type: ignore
+            if field.column_name not in existing
+        ]
+        if len(missing) == 0:
+            return []
+
+        from playhouse.migrate import SqliteMigrator, migrate  # type: ignore
+
+        migrator = SqliteMigrator(cls._meta.database)  # type: ignore
+        with cls._meta.database.atomic():  # type: ignore
+            migrate(
+                *[
+                    migrator.add_column(table, field.column_name, field)
+                    for field in missing
+                ]
+            )
+        return [field.column_name for field in missing]
+
     @classmethod
     def bulk_select(
-        cls, field: Any, values: List[Any], batch_size: int = 999
+        cls: Type[T], field: Any, values: List[Any], batch_size: int = 999
     ) -> Iterable[T]:
         for chunk in chunks(values, batch_size):
             yield from cls.select().where(field.in_(chunk)).execute()  # type: ignore
+
+    @classmethod
+    def bulk_insert(
+        cls, rows: List[Dict[str, Any]], batch_size: Optional[int] = None
+    ) -> List[int]:
+        """
+        Insert many rows with multi-row ``INSERT`` statements in a single
+        transaction, instead of one ``create`` (and commit) per row.
+        No model instances are constructed, and ``save`` is not called.
+
+        :param rows: Field values for each row. ``updated_at`` defaults to now.
+        :param batch_size: Maximum number of rows per statement. By default, as
+                           many as fit into sqlite's limit of 999 parameters.
+        :return: The primary keys of the inserted rows, in order
+        """
+        if "updated_at" in cls._meta.fields:  # type: ignore
+            now = datetime.datetime.now()
+            rows = [dict(row, updated_at=row.get("updated_at", now)) for row in rows]
+
+        if batch_size is None:
+            ncols = len(cls._meta.fields)  # type: ignore
+            batch_size = max(1, 999 // ncols)
+
+        database = cls._meta.database  # type: ignore
+        ids: List[int] = []
+        with database.atomic():
+            for chunk in chunks(rows, batch_size):
+                # the return value of execute() for multi-row inserts differs
+                # between peewee versions, read the rowid from the cursor
+                cursor = database.execute(cls.insert_many(chunk))  # type: ignore
+                last_id = cursor.lastrowid
+                # rows of a single statement get consecutive ids
+                ids.extend(range(last_id - len(chunk) + 1, last_id + 1))
+        return ids
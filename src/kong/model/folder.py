@@ -1,18 +1,116 @@
 import os
 import datetime
+from collections import deque
 
 from typing import Any, cast, Optional, TYPE_CHECKING, List, Iterable, Dict, Tuple
 
 import peewee as pw
-from peewee import sqlite3
 
 from ..logger import logger
+from ..util import chunks
 from ..db import AutoIncrementField, database
 from . import BaseModel
 
 if TYPE_CHECKING:  # pragma: no cover
     from .job import Job
 
+_now = datetime.datetime.now
+
+# Statements are kept as constants so the exact same text is executed every
+# time, which lets sqlite3's statement cache reuse the prepared statements.
+_FOLDER_IDS_RECURSIVE_SQL = """
+WITH RECURSIVE
+  children(n) AS (
+    VALUES(?)
+    UNION
+    SELECT folder_id FROM folder, children
+     WHERE folder.parent_id=children.n
+  )
+SELECT n FROM children WHERE n != ?;
+"""
+
+_FOLDERS_RECURSIVE_SQL = """
+WITH RECURSIVE
+  children(n) AS (
+    VALUES(?)
+    UNION
+    SELECT folder_id FROM folder, children
+     WHERE folder.parent_id=children.n
+  )
+SELECT * FROM folder where folder_id in children AND folder_id != ?;
+"""
+
+_JOBS_RECURSIVE_SQL = """
+WITH RECURSIVE
+  children(n) AS (
+    VALUES(?)
+    UNION
+    SELECT folder_id FROM folder, children
+     WHERE folder.parent_id=children.n
+  )
+SELECT * FROM job where folder_id in children;
+"""
+
+_JOBS_RECURSIVE_STATUS_SQL = """
+WITH RECURSIVE
+  children(n) AS (
+    VALUES(?)
+    UNION
+    SELECT folder_id FROM folder, children
+     WHERE folder.parent_id=children.n
+  )
+SELECT * FROM job where folder_id in children AND status=?;
+"""
+
+_JOB_STATS_SQL = """
+WITH RECURSIVE
+  children(n) AS (
+    VALUES(?)
+    UNION
+    SELECT folder_id FROM folder, children
+     WHERE folder.parent_id=children.n
+  )
+SELECT status, count() FROM job where folder_id in children GROUP BY status;
+"""
+
+_JOB_STATS_BULK_SQL = """
+WITH RECURSIVE
+    walk(root, n) AS (
+        SELECT folder_id, folder_id FROM folder
+        WHERE folder_id IN ({params})
+        UNION ALL
+        SELECT walk.root, folder.folder_id FROM folder JOIN walk
+        ON folder.parent_id=walk.n
+    )
+SELECT walk.root, job.status, count() FROM job JOIN walk ON job.folder_id=walk.n
+GROUP BY walk.root, job.status;
+"""
+
+_DELETE_RECURSIVE_BULK_SQL = """
+WITH RECURSIVE
+    walk(n) AS (
+        SELECT folder_id FROM folder
+        WHERE folder_id IN ({params})
+        UNION
+        SELECT folder.folder_id FROM folder JOIN walk
+        ON folder.parent_id=walk.n
+    )
+DELETE FROM {table} WHERE folder_id IN walk;
+"""
+
+_JOBS_RECURSIVE_BULK_SQL = """
+WITH RECURSIVE
+    walk(root, n) AS (
+        SELECT folder_id, folder_id FROM folder
+        WHERE folder_id IN ({params})
+        UNION ALL
+        SELECT walk.root, folder.folder_id FROM folder JOIN walk
+        ON folder.parent_id=walk.n
+    )
+SELECT job.*, walk.root AS walk_root FROM job JOIN walk ON job.folder_id=walk.n
+ORDER BY job.rowid;
+"""
+
 
 class Folder(BaseModel):
     """
@@ -24,6 +122,7 @@ class Folder(BaseModel):
                   for the root folder
     :ivar created_at: Timestamp of creation of this folder instance
     :ivar updated_at: When the instance was last updated.
+    :ivar cached_path: Denormalized absolute path of this folder, maintained on save.
 
 
     """
@@ -31,38 +130,129 @@ class Folder(BaseModel):
     if TYPE_CHECKING:  # pragma: no cover
         folder_id: int
         parent: "Folder"
+        parent_id: Optional[int]
         children: List["Folder"]
         name: str
         jobs: List[Job]
+        cached_path: Optional[str]
     else:
         folder_id = AutoIncrementField()
         name = pw.CharField()
-        parent = pw.ForeignKeyField("self", null=True, backref="children")
-        created_at = pw.DateTimeField(default=datetime.datetime.now)
+        # indexed, the recursive CTEs join on parent_id at every level
+        parent = pw.ForeignKeyField("self", null=True, backref="children", index=True)
+        created_at = pw.DateTimeField(default=_now)
         updated_at = pw.DateTimeField()
+        # null only for rows created before this column existed
+        cached_path = pw.CharField(index=True, null=True)
 
     _ignore_save_assert = False
 
+    # (connection, root) of the last get_root call, see there
+    _root_cache: Optional[Tuple[Any, "Folder"]] = None
+
     class Meta:
         indexes = ((("parent", "name"), True),)
 
     def save(self, *args: Any, **kwargs: Any) -> None:
         if not self._ignore_save_assert:
-            assert (
-                self.name not in (".", "..", "")
-                and "/" not in self.name
-                and not self.name.isdigit()
-            ), f"Invalid folder name '{self.name}'"
-            assert self.parent is not None, "Need to specify a parent folder"
+            self._check_name(self.name)
+            assert self.parent_id is not None, "Need to specify a parent folder"
         self._ignore_save_assert = False
 
-        # can never be its own parent
-        if self.parent == self:
+        # can never be its own parent, compare ids to avoid loading the parent
+        if self.parent_id is not None and self.parent_id == self.folder_id:
             raise pw.IntegrityError("Folder can not be its own parent")
 
-        self.updated_at = datetime.datetime.now()
+        self.updated_at = _now()
+
+        old_path = self.cached_path
+        self.cached_path = self._make_path()
 
-        return super().save(*args, **kwargs)
+        with database.atomic():
+            res = super().save(*args, **kwargs)
+            if old_path is not None and old_path != self.cached_path:
+                self._update_descendant_paths(old_path)
+        return res
+
+    @staticmethod
+    def _check_name(name: str) -> None:
+        assert (
+            name not in (".", "..", "") and "/" not in name and not name.isdigit()
+        ), f"Invalid folder name '{name}'"
+
+    def _make_path(self) -> str:
+        if self.parent_id is None:
+            return "/"
+        # the parent instance might be outdated, take the path from the database.
+        # walk up iteratively until an ancestor with a cached path is found
+        names = [self.name]
+        parent_id = self.parent_id
+        while True:
+            parent_path, name, parent_id = (
+                Folder.select(Folder.cached_path, Folder.name, Folder.parent)
+                .where(Folder.folder_id == parent_id)
+                .tuples()
+                .get()
+            )
+            if parent_path is not None:
+                break
+            if parent_id is None:
+                parent_path = "/"  # reached the root
+                break
+            names.append(name)
+        return cast(str, os.path.join(parent_path, *reversed(names)))
+
+    def refresh_path(self) -> None:
+        """
+        Recompute :attr:`cached_path` from the parent folder and propagate it to
+        all descendants. Needed if the parent was changed without :meth:`save`,
+        e.g. through a bulk update query.
+        """
+        old_path = self.cached_path
+        self.cached_path = self._make_path()
+        with database.atomic():
+            Folder.update(cached_path=self.cached_path).where(
+                Folder.folder_id == self.folder_id
+            ).execute()
+            if old_path is not None and old_path != self.cached_path:
+                self._update_descendant_paths(old_path)
+
+    def _update_descendant_paths(self, old_path: str) -> None:
+        # rewrite the path prefix of all descendants, after this folder was
+        # renamed or moved
+        prefix = old_path + "/"
+        Folder.update(
+            cached_path=pw.Value(self.path).concat(
+                pw.fn.substr(Folder.cached_path, len(prefix))
+            )
+        ).where(pw.fn.substr(Folder.cached_path, 1, len(prefix)) == prefix).execute()
+
+    @classmethod
+    def backfill_cached_paths(cls) -> None:
+        """
+        Populate :attr:`cached_path` for folders created before the column
+        was introduced. Walks the hierarchy from the root downward.
+        """
+        if not cls.select().where(cls.cached_path.is_null()).exists():  # type: ignore
+            return
+        logger.debug("Backfilling cached folder paths")
+        with database.atomic():
+            root = cls.get_root()
+            cls.update(cached_path="/").where(cls.folder_id == root.folder_id).execute()
+            queue = deque([(root.folder_id, "/")])
+            while queue:
+                folder_id, path = queue.popleft()
+                children = (
+                    cls.select(cls.folder_id, cls.name)
+                    .where(cls.parent == folder_id)
+                    .tuples()
+                )
+                for child_id, name in children:
+                    child_path = os.path.join(path, name)
+                    cls.update(cached_path=child_path).where(
+                        cls.folder_id == child_id
+                    ).execute()
+                    queue.append((child_id, child_path))
 
     @property
     def path(self) -> str:
@@ -71,22 +261,27 @@ class Folder(BaseModel):
 
         :return: The path
         """
-        if self.parent is None:
-            return "/"
-        # this will be slow, could optimize with CTE
-        return cast(str, os.path.join(self.parent.path, self.name))
+        if self.cached_path is not None:
+            return self.cached_path
+        return self._make_path()
 
     @classmethod
     def get_root(cls) -> "Folder":
         """
         Retrieve the root folder (/). There can be only one.
+        The instance is memoized for the current database connection,
+        so a reconnect (or re-init) of the database fetches it again.
 
         :return: Root folder instance
         """
+        conn = database.connection()
+        if Folder._root_cache is not None and Folder._root_cache[0] is conn:
+            return Folder._root_cache[1]
         folder = Folder.get_or_none(Folder.parent.is_null(), name="root")
         if folder is None:
             # bypass assertions
             folder = super(BaseModel, cls).create(name="root", _ignore_save_assert=True)
+        Folder._root_cache = (conn, folder)
         return cast(Folder, folder)
 
     @staticmethod
@@ -101,35 +296,45 @@ class Folder(BaseModel):
 
         assert isinstance(path, str)
 
-        if cwd is None:
-            cwd = Folder.get_root()
-
-        assert isinstance(cwd, Folder)
-
         if path == "/":
             return Folder.get_root()
+
+        # normalize in python, leading ".." are kept to be applied to cwd
+        rel: List[str] = []
+        for part in path.split("/"):
+            if part in ("", "."):
+                continue
+            if part == ".." and len(rel) > 0 and rel[-1] != "..":
+                rel.pop()
+            else:
+                rel.append(part)
+
         if path.startswith("/"):
-            return Folder.find_by_path(path[1:], Folder.get_root())
-        if path.endswith("/"):
-            path = path[:-1]
-        if path == "..":
-            return cwd.parent
-        if path == "" or path == ".":
-            return cwd
-        if "/" not in path:
-            return cwd.subfolder(path)
-        head, tail = path.split(os.sep, 1)
-        logger.debug("Resolve path %s in %s: %s, %s", path, cwd.path, head, tail)
-
-        if head == "..":
-            if cwd.parent is None:
-                return None
-            return Folder.find_by_path(tail, cwd.parent)
+            if ".." in rel:
+                return None  # above root
+            parts = rel
         else:
-            next_cwd: Optional[Folder] = cwd.subfolder(head)
-            if next_cwd is None:
-                return None
-            return Folder.find_by_path(tail, next_cwd)
+            if cwd is None:
+                cwd = Folder.get_root()
+            assert isinstance(cwd, Folder)
+            if len(rel) == 0:
+                return cwd
+            parts = [p for p in cwd.path.split("/") if p != ""]
+            for part in rel:
+                if part == "..":
+                    if len(parts) == 0:
+                        return None  # above root
+                    parts.pop()
+                else:
+                    parts.append(part)
+
+        if len(parts) == 0:
+            return Folder.get_root()
+        logger.debug("Resolve path %s to /%s", path, "/".join(parts))
+        # single lookup on the cached path instead of one query per segment
+        return cast(
+            Optional[Folder], Folder.get_or_none(cached_path="/" + "/".join(parts))
+        )
 
     def __truediv__(self, name: str) -> Optional["Folder"]:
         return self.subfolder(name)
@@ -143,6 +348,39 @@ class Folder(BaseModel):
         """
         return Folder.create(name=name, parent=self)
 
+    def add_folder_tree(self, tree: Dict[str, Any]) -> List["Folder"]:
+        """
+        Create a hierarchy of folders below this folder instance. Every level of
+        the tree is inserted with a single bulk insert, with the paths of the
+        new folders computed upfront.
+
+        :param tree: Nested dictionary of folder name to subtree. Subtrees can
+                     be dictionaries of the same form, or `None` for leaves.
+        :return: The new folder instances, level by level
+        """
+        created: List[Folder] = []
+        level: List[Tuple[Folder, Optional[Dict[str, Any]]]] = [(self, tree)]
+        with database.atomic():
+            while len(level) > 0:
+                rows = []
+                subtrees: Dict[str, Optional[Dict[str, Any]]] = {}
+                for parent, subtree in level:
+                    for name, children in (subtree or {}).items():
+                        Folder._check_name(name)
+                        path = os.path.join(parent.path, name)
+                        rows.append(
+                            dict(name=name, parent=parent.folder_id, cached_path=path)
+                        )
+                        subtrees[path] = children
+
+                Folder.bulk_insert(rows)
+                folders: List[Folder] = list(
+                    Folder.bulk_select(Folder.cached_path, list(subtrees.keys()))
+                )
+                created += folders
+                level = [(f, subtrees[cast(str, f.cached_path)]) for f in folders]
+        return created
+
     def subfolder(self, name: str) -> Optional["Folder"]:
         """
         Retrieve a direct subfolder of this folder instance
@@ -152,107 +390,143 @@ class Folder(BaseModel):
         """
         return Folder.get_or_none(Folder.parent == self, Folder.name == name)
 
+    def folders_recursive_ids(self) -> Iterable[int]:
+        """
+        Like :meth:`folders_recursive`, but only returns the folder IDs, without
+        constructing model instances.
+
+        :return: IDs of all folders in the hierarchy from this folder.
+                 (Excludes this folder)
+        """
+        cursor = cast(
+            Iterable[Tuple[int]],
+            database.execute_sql(
+                _FOLDER_IDS_RECURSIVE_SQL, (int(self.folder_id), int(self.folder_id))
+            ),
+        )
+        return (row[0] for row in cursor)
+
     def folders_recursive(self) -> Iterable["Folder"]:
         """
         Recursively find all folders below this one.
 
         :return: All folders in the hierarchy from this folder. (Excludes this folder)
         """
-        crit = (3, 8, 3)
-        if sqlite3.sqlite_version_info < crit:  # pragma: no cover
-            logger.debug(
-                "sqlite3 version %s < %s: use slow python recursion",
-                sqlite3.sqlite_version_info,
-                crit,
-            )
-            folders: List["Folder"] = []
-            for child in self.children:
-                folders.append(child)
-                folders += child.folders_recursive()
-            return folders
-
-        else:
-            logger.debug(
-                "sqlite3 version %s >= %s: use CTE", sqlite3.sqlite_version_info, crit
-            )
-            sql = """
-    WITH RECURSIVE
-      children(n) AS (
-        VALUES(?)
-        UNION
-        SELECT folder_id FROM folder, children
-         WHERE folder.parent_id=children.n
-      )
-    SELECT * FROM folder where folder_id in children AND folder_id != ?;
-    """
+        return Folder.raw(
+            _FOLDERS_RECURSIVE_SQL, int(self.folder_id), int(self.folder_id)
+        )
 
-            return Folder.raw(sql, int(self.folder_id), int(self.folder_id))
-
-    def jobs_recursive(self) -> Iterable["Job"]:
+    def jobs_recursive(self, status: Optional["Job.Status"] = None) -> Iterable["Job"]:
         """
         Recursively get all jobs in this folder and descendants.
 
+        :param status: Only select jobs with this status
         :return: Iterable over all jobs found, including jobs directly in this folder.
         """
-        crit = (3, 8, 3)
-        if sqlite3.sqlite_version_info < crit:  # pragma: no cover
-            logger.debug(
-                "sqlite3 version %s < %s: use slow python recursion",
-                sqlite3.sqlite_version_info,
-                crit,
-            )
-            jobs: List["Job"] = list(self.jobs)
-            for child in self.children:
-                jobs += child.jobs_recursive()
-            return jobs
-        else:
-            logger.debug(
-                "sqlite3 version %s >= %s: use CTE", sqlite3.sqlite_version_info, crit
+        if status is not None:
+            return Job.raw(_JOBS_RECURSIVE_STATUS_SQL, int(self.folder_id), int(status))
+        return Job.raw(_JOBS_RECURSIVE_SQL, int(self.folder_id))
+
+    @staticmethod
+    def jobs_recursive_bulk(
+        folder_ids: List[int], batch_size: int = 500
+    ) -> Dict[int, List["Job"]]:
+        """
+        Calculate :meth:`jobs_recursive` for a number of folders at once, using
+        one recursive CTE per batch of folders instead of one per folder.
+
+        :param folder_ids: IDs of the folders to collect jobs for
+        :param batch_size: Maximum number of folders to bind in one query
+        :return: Dictionary of folder ID to the jobs in and below that folder
+        """
+        jobs: Dict[int, List[Job]] = {folder_id: [] for folder_id in folder_ids}
+        for chunk in chunks(list(jobs.keys()), batch_size):
+            query: Iterable[Job] = Job.raw(
+                _JOBS_RECURSIVE_BULK_SQL.format(params=", ".join("?" * len(chunk))),
+                *[int(i) for i in chunk],
             )
-            sql = """
-            WITH RECURSIVE
-              children(n) AS (
-                VALUES(?)
-                UNION
-                SELECT folder_id FROM folder, children
-                 WHERE folder.parent_id=children.n
-              )
-            SELECT * FROM job where folder_id in children;
-            """
+            for job in query:
+                jobs[job.walk_root].append(job)  # type: ignore
+        return jobs
+
+    @staticmethod
+    def delete_recursive_bulk(folder_ids: List[int], batch_size: int = 500) -> None:
+        """
+        Delete a number of folders, together with all folders and jobs below them.
+        Unlike :meth:`delete_instance` with ``recursive=True``, this takes one
+        DELETE statement for the jobs and one for the folders per batch of folders.
+
+        .. note::
+           This only removes the database rows, see
+           :meth:`kong.drivers.driver_base.DriverBase.bulk_remove` for jobs.
 
-            from .job import Job
+        :param folder_ids: IDs of the folders to delete
+        :param batch_size: Maximum number of folders to bind in one query
+        """
+        with database.atomic():
+            for chunk in chunks(folder_ids, batch_size):
+                params = ", ".join("?" * len(chunk))
+                args = [int(i) for i in chunk]
+                # jobs first, while the folders can still be walked
+                database.execute_sql(
+                    _DELETE_RECURSIVE_BULK_SQL.format(params=params, table="job"), args
+                )
+                database.execute_sql(
+                    _DELETE_RECURSIVE_BULK_SQL.format(params=params, table="folder"),
+                    args,
+                )
+
+    def jobs_recursive_with_folder(self) -> List["Job"]:
+        """
+        Like :meth:`jobs_recursive`, but with the folder of every job loaded
+        alongside, see :meth:`kong.model.job.Job.prefetch_folders`.
 
-            return Job.raw(sql, int(self.folder_id))
+        :return: List of all jobs found, including jobs directly in this folder.
+        """
+        return Job.prefetch_folders(self.jobs_recursive())
 
     def job_stats(self) -> Dict["Job.Status", int]:
-        crit = (3, 8, 3)
-        if sqlite3.sqlite_version_info < crit:  # pragma: no cover
-            jobs = self.jobs_recursive()
-            counts = {k: 0 for k in Job.Status}
-            for job in jobs:
-                counts[job.status] += 1
-            return counts
-        else:
-            sql = """
-WITH RECURSIVE
-    children(n) AS (
-       VALUES(?)
-        UNION
-        SELECT folder_id FROM folder, children
-        WHERE folder.parent_id=children.n
-    )
-SELECT status, count() FROM job where folder_id in children GROUP BY status;
-            """
+        cursor = cast(
+            Iterable[Tuple[int, int]],
+            database.execute_sql(_JOB_STATS_SQL, (int(self.folder_id),)),
+        )
+        counts = {k: 0 for k in Job.Status}
+        from_db = Job._meta.fields["status"].from_db  # type: ignore
+        for status, count in cursor:
+            counts[from_db[status]] = count
+
+        return counts
+
+    @staticmethod
+    def job_stats_bulk(
+        folder_ids: List[int], batch_size: int = 500
+    ) -> Dict[int, Dict["Job.Status", int]]:
+        """
+        Calculate :meth:`job_stats` for a number of folders at once. Instead of
+        one recursive CTE per folder, every batch of folders is handled by a single
+        CTE, which carries the folder a subtree started from along.
+
+        :param folder_ids: IDs of the folders to calculate job stats for
+        :param batch_size: Maximum number of folders to bind in one query
+        :return: Dictionary of folder ID to status counts
+        """
+        stats: Dict[int, Dict[Job.Status, int]] = {
+            folder_id: {k: 0 for k in Job.Status} for folder_id in folder_ids
+        }
 
+        for chunk in chunks(list(stats.keys()), batch_size):
             cursor = cast(
-                Iterable[Tuple[int, int]],
-                database.execute_sql(sql, (int(self.folder_id),)),
+                Iterable[Tuple[int, int, int]],
+                database.execute_sql(
+                    _JOB_STATS_BULK_SQL.format(params=", ".join("?" * len(chunk))),
+                    tuple(int(i) for i in chunk),
+                ),
             )
-            counts = {k: 0 for k in Job.Status}
-            for status, count in cursor:
-                counts[Job.Status(status)] = count
+            from_db = Job._meta.fields["status"].from_db  # type: ignore
+            for root, status, count in cursor:
+                stats[root][from_db[status]] = count
 
-            return counts
+        return stats
 
 
 # Needed for RTD
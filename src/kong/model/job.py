@@ -1,10 +1,24 @@
 import datetime
 from concurrent.futures._base import Executor
-from contextlib import contextmanager
 from enum import IntFlag
 from functools import wraps
-from typing import Any, List, Dict, Union, cast, TYPE_CHECKING, Optional, Type, Iterator
-
+from types import ModuleType
+from typing import (
+    Any,
+    List,
+    Dict,
+    Union,
+    cast,
+    TYPE_CHECKING,
+    Optional,
+    Type,
+    Iterable,
+    ContextManager,
+    IO,
+    Tuple,
+)
+
+import click
 import peewee as pw
 
 from ..json_field import JSONField
@@ -16,16 +30,19 @@ from ..model.folder import Folder
 from . import BaseModel
 from ..util import get_size
 
+_now = datetime.datetime.now
+
 
 class EnumField(pw.IntegerField):
     def __init__(self, choices: List, *args: Any, **kwargs: Any):
-        self.from_db: Dict[int, str] = {int(k): k for k in choices}
+        # maps to the enum members themselves, no conversion needed by callers
+        self.from_db: Dict[int, IntFlag] = {int(k): k for k in choices}
         super(pw.IntegerField, self).__init__(*args, **kwargs)
 
     def db_value(self, value: "Job.Status") -> int:
         return int(value)
 
-    def python_value(self, value: int) -> str:
+    def python_value(self, value: int) -> IntFlag:
         return self.from_db[value]
 
 
@@ -41,22 +58,35 @@ def with_driver(f: Any) -> Any:
 
 
 class DriverField(pw.CharField):
+    # class name -> (module, attribute) and class -> name, shared between instances
+    _to_module: Dict[str, Tuple[ModuleType, str]] = {}
+    _to_name: Dict[Type[DriverBase], str] = {}
+
     def __init__(self, *args: Any, **kwargs: Any):
         return super().__init__(*args, **kwargs)
 
     def db_value(self, value: Any) -> str:
-        assert issubclass(value, DriverBase)
-        class_name = ".".join([value.__module__, value.__name__])
+        class_name = self._to_name.get(value)
+        if class_name is None:
+            assert issubclass(value, DriverBase)
+            class_name = ".".join([value.__module__, value.__name__])
+            self._to_name[value] = class_name
         return class_name
 
-    def python_value(selfself, value: str) -> Type[DriverBase]:
-        import importlib
+    def python_value(self, value: str) -> Type[DriverBase]:
+        entry = self._to_module.get(value)
+        if entry is None:
+            import importlib
 
-        components = value.split(".")
-        module_name = ".".join(components[:-1])
-        class_name = components[-1]
+            components = value.split(".")
+            module_name = ".".join(components[:-1])
+            class_name = components[-1]
 
-        module = importlib.import_module(module_name)
+            entry = (importlib.import_module(module_name), class_name)
+            self._to_module[value] = entry
+
+        # resolve the attribute every time, the module is what's expensive
+        module, class_name = entry
         class_ = getattr(module, class_name)
         return cast(Type[DriverBase], class_)
 
@@ -126,7 +156,7 @@ class Job(BaseModel):
         )  # can be null, some drivers only know after submission
         # driver = EnumField(choices=drivers.__all__, null=False)
         driver = DriverField(null=False)
-        folder = pw.ForeignKeyField(Folder, null=False, backref="jobs")
+        folder = pw.ForeignKeyField(Folder, null=False, backref="jobs", index=True)
         command = pw.CharField(null=False)  # should allow arbitrary length in sqlite
         data = JSONField(default={})
         cores = pw.IntegerField(null=False, default=1)
@@ -170,7 +200,7 @@ class Job(BaseModel):
         # assert self.driver in drivers.__all__, f"{self.driver} is not a valid driver"
         assert self.command is not None, "Need to specify a command"
         assert len(self.command) > 0, "Command must be longer than 0"
-        self.updated_at = datetime.datetime.now()
+        self.updated_at = _now()
         super().save(*args, **kwargs)
 
     @with_driver
@@ -253,31 +283,48 @@ class Job(BaseModel):
         driver.sync_status(self)
         return self.status
 
-    @with_driver  # type: ignore
-    @contextmanager  # type: ignore
-    def stdout(self, driver: DriverBase) -> Iterator[None]:
+    @with_driver
+    def stdout(self, driver: DriverBase) -> ContextManager[IO[str]]:
         """
         stdout()
 
         Convenience context manager to open a read file handle to the job's stdout.
+        The driver's context manager is returned as is.
         """
-        with driver.stdout(self) as fh:
-            yield fh
+        return cast(ContextManager[IO[str]], driver.stdout(self))
 
-    @with_driver  # type: ignore
-    @contextmanager  # type: ignore
-    def stderr(self, driver: DriverBase) -> Iterator[None]:
+    @with_driver
+    def stderr(self, driver: DriverBase) -> ContextManager[IO[str]]:
         """
         stderr()
 
         Convenience context manager to open a read file handle to the job's stderr.
+        The driver's context manager is returned as is.
         """
-        with driver.stderr(self) as fh:
-            yield fh
+        return cast(ContextManager[IO[str]], driver.stderr(self))
 
     def __str__(self) -> str:
         return f"Job<{self.job_id}, {self.batch_job_id}, {str(self.status)}>"
 
+    @staticmethod
+    def prefetch_folders(jobs: Iterable["Job"]) -> List["Job"]:
+        """
+        Load the folders of a number of jobs in bulk, so that accessing
+        ``job.folder`` does not issue one query per job.
+
+        :param jobs: The jobs to load folders for
+        :return: List of the jobs, with their folders attached
+        """
+        jobs = list(jobs)
+        folder_ids = list({job.folder_id for job in jobs})  # type: ignore
+        folders: Dict[int, Folder] = {
+            f.folder_id: f for f in Folder.bulk_select(Folder.folder_id, folder_ids)
+        }
+        for job in jobs:
+            # populate the relation cache without marking the field as dirty
+            job.__rel__["folder"] = folders[job.folder_id]  # type: ignore
+        return jobs
+
     def size(self, ex: Optional[Executor] = None) -> int:
         """
         Retrieve the size of the job output.
@@ -297,3 +344,32 @@ color_dict = {
     Job.Status.FAILED: "red",
     Job.Status.COMPLETED: "green",
 }
+
+# status values are small contiguous ints, index a tuple instead of hashing
+_status_colors = tuple(color_dict[Job.Status(i)] for i in range(len(color_dict)))
+
+
+def status_color(status: "Job.Status") -> str:
+    """
+    Get the display color of a job status.
+
+    :param status: The job status
+    :return: Color name, as understood by click
+    """
+    return _status_colors[status]
+
+
+# ANSI sequences per status, so styling text doesn't go through click.style
+_style_reset = "\x1b[0m"
+_status_prefixes = tuple(click.style("", fg=c, reset=False) for c in _status_colors)
+
+
+def style_status(text: Any, status: "Job.Status") -> str:
+    """
+    Color a text in the display color of a job status.
+
+    :param text: The text to color
+    :param status: The job status
+    :return: The styled text
+    """
+    return f"{_status_prefixes[status]}{text}{_style_reset}"
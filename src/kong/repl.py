@@ -1,28 +1,32 @@
-import copy
 import datetime
-import shlex
+import functools
+import itertools
 import cmd
 import readline
 import os
+import signal
 import subprocess
 import sys
-import time
-from concurrent.futures import wait, ThreadPoolExecutor
+from concurrent.futures import wait, Future, ThreadPoolExecutor
 
 import humanfriendly
-import sh
 from typing import Any, Callable, List, Optional, Union, Iterable, cast, Dict, Tuple
 import shutil
-import dateutil.tz
-import pytz
 
 import click
 import peewee as pw
-from click import style
-from kong.model.job import color_dict
+from kong.model.job import status_color, style_status
 from .table import format_table
-
-from .util import shorten_path, Spinner, set_verbosity
+from .executor import SerialExecutor
+
+from .util import (
+    shorten_path,
+    Spinner,
+    set_verbosity,
+    split_args,
+    tail_lines,
+    wait_for_path,
+)
 from .state import DoesNotExist
 from .config import APP_NAME, APP_DIR
 from .logger import logger
@@ -32,44 +36,108 @@ from . import state
 
 history_file = os.path.join(APP_DIR, "history")
 
+_status_headers = tuple(style_status(s.name, s) for s in Job.Status)
+
+
+def to_local_time(dt: datetime.datetime) -> datetime.datetime:
+    # timestamps are stored as naive UTC. astimezone without an argument goes
+    # through time.localtime, which is much cheaper than resolving a tzinfo
+    # object for every timestamp
+    return dt.replace(tzinfo=datetime.timezone.utc).astimezone()
+
+
+# equivalent to strftime("%Y-%m-%d %H:%M:%S") and strftime("%H:%M:%S"),
+# %-formatting the fields directly is a few times faster
+def format_datetime(dt: datetime.datetime) -> str:
+    return "%04d-%02d-%02d %02d:%02d:%02d" % (
+        dt.year,
+        dt.month,
+        dt.day,
+        dt.hour,
+        dt.minute,
+        dt.second,
+    )
+
+
+def format_time(dt: datetime.datetime) -> str:
+    return "%02d:%02d:%02d" % (dt.hour, dt.minute, dt.second)
+
+
+@functools.lru_cache(maxsize=256)
+def _child_names(cwd: Folder, head: str, prefix: str) -> Tuple[str, ...]:
+    folder = Folder.find_by_path(head, cwd)
+    assert folder is not None
+    # only the names are needed, skip constructing the folder instances
+    query = Folder.select(Folder.name).where(Folder.parent == folder)
+    if prefix != "":
+        # a range instead of LIKE, which is case insensitive in sqlite and
+        # can't use the (parent, name) index
+        query = query.where(Folder.name >= prefix, Folder.name < prefix + "\U0010ffff")
+    return tuple(name for (name,) in query.tuples() if name.startswith(prefix))
+
 
 def complete_path(cwd: Folder, path: str) -> List[str]:
+    """
+    Complete a folder path. Results are cached, since readline completes the
+    same prefix repeatedly. Call ``clear_completion_cache`` when folders change.
+
+    :param cwd: The folder relative paths are resolved against
+    :param path: The partial path to complete
+    :return: Matching folder names, with trailing slash
+    """
     logger.debug("Completion of '%s'", path)
     if path.endswith("/"):
-        folder = Folder.find_by_path(path, cwd)
-        prefix = ""
+        head, prefix = path, ""
     else:
         head, prefix = os.path.split(path)
-        folder = Folder.find_by_path(head, cwd)
 
-    assert folder is not None
-    options = []
-    for child in folder.children:
-        if child.name.startswith(prefix):
-            options.append(child.name + "/")
-    return options
+    return [name + "/" for name in _child_names(cwd, head, prefix)]
+
+
+def clear_completion_cache() -> None:
+    _child_names.cache_clear()
 
 
 def parse_arguments(fn: Any) -> Callable[[Any, str], None]:
     _, prog_name = fn.__name__.split("_", 1)
 
-    orig_fn = copy.deepcopy(fn)
+    orig_fn = fn
     fn = click.pass_obj(fn)
     command = click.command()(fn)
 
+    # commands are mostly called without any arguments. The parameters for
+    # that case don't change, resolve them once instead of on every call.
+    help_option_names = ["-h", "--help"]
+    default_params: Optional[Dict[str, Any]] = None
+    try:
+        with command.make_context(
+            prog_name, [], help_option_names=help_option_names
+        ) as ctx:
+            default_params = dict(ctx.params)
+    except click.ClickException:
+        # required arguments, those always need parsing
+        pass
+
     def wrapped(self: Any, argstr: str) -> None:
-        argv = shlex.split(argstr)
+        argv = split_args(argstr)
         logger.debug("%s", argv)
+        # command.main is built for standalone programs (environment and shell
+        # completion handling), only parsing and invocation is needed here
         try:
-            command.main(
-                args=argv,
-                prog_name=prog_name,
-                standalone_mode=False,
-                obj=self,
-                help_option_names=["-h", "--help"],
-            )
+            if len(argv) == 0 and default_params is not None:
+                orig_fn(self, **default_params)
+                return
+            with command.make_context(
+                prog_name, argv, obj=self, help_option_names=help_option_names
+            ) as ctx:
+                command.invoke(ctx)
+        except click.exceptions.Exit:
+            # --help
+            pass
         except click.MissingParameter:
             click.echo(f"usage: {fn.__doc__}")
+        except (EOFError, KeyboardInterrupt) as e:
+            raise click.Abort() from e
 
     wrapped.__doc__ = fn.__doc__  # type: ignore
     wrapped.__name__ = fn.__name__  # type: ignore
@@ -84,8 +152,26 @@ class Repl(cmd.Cmd):
 
     _raise: bool = False
 
+    # shared by all commands, created on first use
+    _io_pool: Optional[ThreadPoolExecutor] = None
+
+    # output sizes of finished jobs, keyed by job id and last update
+    size_cache_max: int = 10000
+    _size_cache: Dict[Tuple[int, datetime.datetime], int]
+
+    # rewrite (and truncate) the full history file every this many commands,
+    # in between only new entries are appended
+    history_rewrite_interval: int = 50
+    _history_saved_length: int = 0
+    _commands_since_rewrite: int = 0
+
     def __init__(self, state: state.State) -> None:
         self.state = state
+        self._size_cache = {}
+        # commands piped in from a script don't end up in the readline
+        # history, skip all history file handling for them
+        self._use_readline = sys.stdin.isatty()
+        clear_completion_cache()
         super().__init__()
 
     def precmd(self, line: str) -> str:
@@ -106,10 +192,12 @@ class Repl(cmd.Cmd):
         )
 
         # find component
-        parts = shlex.split(line)
+        parts = split_args(line)
         base: Optional[str] = None
-        for i, part in enumerate(parts):  # pragma: no branch
-            prelength = len(" ".join(parts[: i + 1]))
+        # length of the parts joined by single spaces, up to the current one
+        prelength = -1
+        for part in parts:  # pragma: no branch
+            prelength += len(part) + 1
             if prelength >= begidx:
                 base = part
                 break
@@ -118,15 +206,12 @@ class Repl(cmd.Cmd):
         return complete_path(self.state.cwd, base)  # type: ignore
 
     def onecmd(self, *args: str) -> bool:
+        # any command may modify folders, only repeated completions in
+        # between commands are served from the cache
+        clear_completion_cache()
         try:
             res = super().onecmd(*args)
-            # logger.debug(
-            #     "Writing history of length %d to file %s",
-            #     self.state.config.history_length,
-            #     history_file,
-            # )
-            readline.set_history_length(self.state.config.history_length)
-            readline.write_history_file(history_file)
+            self._save_history()
             return res
         except (BaseException, Exception) as e:
             logger.debug("Exception occured", exc_info=True)
@@ -182,10 +267,15 @@ class Repl(cmd.Cmd):
         "List the directory content of DIR: jobs and folders"
         try:
             ex: Optional[ThreadPoolExecutor] = None
-            if show_sizes:
-                ex = ThreadPoolExecutor()
 
-            folders, jobs = self.state.ls(dir, refresh=refresh)
+            status_filter = (
+                Job.Status[status_filter_str] if status_filter_str is not None else None
+            )
+
+            # refresh separately below, to show a spinner
+            folders, jobs = self.state.ls(
+                dir, recursive=recursive, status=status_filter if not refresh else None
+            )
 
             _extra_columns = extra_columns.split(",") if extra_columns != "" else []
 
@@ -193,42 +283,45 @@ class Repl(cmd.Cmd):
 
             logger.debug("Extra columns: %s", _extra_columns)
 
-            if recursive:
-                arg_folder = Folder.find_by_path(dir, self.state.cwd)
-                assert arg_folder is not None  # should be a folder
-                jobs = list(arg_folder.jobs_recursive())
-
             with Spinner("Refreshing jobs", persist=False, enabled=refresh):
 
                 if refresh:
                     jobs = cast(list, self.state.refresh_jobs(jobs))
+                    if status_filter is not None:
+                        jobs = [job for job in jobs if job.status == status_filter]
 
-            def get_size(job: Job) -> int:
-                return job.size(cast(ThreadPoolExecutor, ex))
-
-            def get_folder_size(folder: Folder) -> int:
-                # print("get folder size: ", folder.path)
-                return sum(
-                    cast(ThreadPoolExecutor, ex).map(get_size, folder.jobs_recursive())
-                )
+            if show_sizes and (len(folders) > 0 or len(jobs) > 1):
+                # a single job is cheaper to size without threads
+                ex = self._get_io_pool()
 
             folder_sizes: List[int] = []
             jobs_sizes: List[int] = []
             if show_sizes:
-                ex_ = cast(ThreadPoolExecutor, ex)
+                ex_ = ex or SerialExecutor()
                 with Spinner("Calculating output sizes", persist=False):
-                    folder_size_futures = []
-                    for folder in folders:
-                        folder_size_futures.append(ex_.submit(get_folder_size, folder))
-
-                    job_size_futures = []
-                    for job in jobs:
-                        job_size_futures.append(ex_.submit(get_size, job))
+                    # all jobs below all listed folders in one go
+                    folder_jobs = Folder.jobs_recursive_bulk(
+                        [f.folder_id for f in folders]
+                    )
 
-                    wait(folder_size_futures)
-                    folder_sizes = [f.result() for f in folder_size_futures]
-                    wait(job_size_futures)
-                    jobs_sizes = [f.result() for f in job_size_futures]
+                    # flat fan-out: one task per distinct job, each sizing its
+                    # output serially, so no task ever waits on the same pool
+                    size_futures: Dict[int, Future] = {}
+                    for job in itertools.chain(
+                        jobs, itertools.chain.from_iterable(folder_jobs.values())
+                    ):
+                        if job.job_id not in size_futures:
+                            size_futures[job.job_id] = ex_.submit(self._job_size, job)
+
+                    wait(size_futures.values())
+                    folder_sizes = [
+                        sum(
+                            size_futures[j.job_id].result()
+                            for j in folder_jobs[f.folder_id]
+                        )
+                        for f in folders
+                    ]
+                    jobs_sizes = [size_futures[j.job_id].result() for j in jobs]
 
             if len(folders) > 0:
                 with Spinner("Collection folder information", persist=False):
@@ -239,24 +332,20 @@ class Repl(cmd.Cmd):
                         headers.append("output size")
                         align = ["l", "l+"]
 
-                    for s in Job.Status:
-                        headers.append(click.style(s.name, fg=color_dict[s]))
-                        align.append("r")
+                    headers += _status_headers
+                    align += ["r"] * len(_status_headers)
+
+                    stats = Folder.job_stats_bulk([f.folder_id for f in folders])
 
                 rows = []
                 for idx, folder in enumerate(folders):
-                    counts = folder.job_stats()
-
-                    output = ""
-                    for k, c in counts.items():
-                        output += style(f" {c:> 6d}{k.name[:1]}", fg=color_dict[k])
+                    counts = stats[folder.folder_id]
 
                     row = [folder.name]
                     if show_sizes:
                         row.append(humanfriendly.format_size(folder_sizes[idx]))
-                    # row += [output]
                     for k, c in counts.items():
-                        row.append(click.style(str(c), fg=color_dict[k]))
+                        row.append(style_status(c, k))
 
                     rows.append(tuple(row))
 
@@ -281,55 +370,42 @@ class Repl(cmd.Cmd):
                     headers += ["batch job id", "created", "updated", "status"]
                     align += ["r+", "l", "l", "l"]
 
-                    def dfcnv(dt: datetime.datetime) -> datetime.datetime:
-                        return dt.replace(tzinfo=pytz.utc).astimezone(
-                            dateutil.tz.tzlocal()
-                        )
-
-                    tfmt = "%H:%M:%S"
-                    dtfmt = f"%Y-%m-%d {tfmt}"
-
                     rows = []
-                    status_filter = (
-                        Job.Status[status_filter_str]
-                        if status_filter_str is not None
-                        else None
-                    )
+                    row_colors: List[Optional[str]] = []
                     for idx, job in enumerate(jobs):
-
-                        if status_filter is not None:
-                            if job.status != status_filter:
-                                continue
-
                         job_id = str(job.job_id)
                         batch_job_id = str(job.batch_job_id)
-                        _, status_name = str(job.status).split(".", 1)
-                        color = color_dict[job.status]
+                        status_name = job.status.name
                         row = [job_id]
                         if show_sizes:
                             row.append(humanfriendly.format_size(jobs_sizes[idx]))
 
-                        created_at = dfcnv(job.created_at)
-                        updated_at = dfcnv(job.updated_at)
+                        created_at = to_local_time(job.created_at)
+                        updated_at = to_local_time(job.updated_at)
 
                         if created_at.date() == updated_at.date():
-                            updated_at_str = updated_at.strftime(tfmt)
+                            updated_at_str = format_time(updated_at)
                         else:
-                            updated_at_str = updated_at.strftime(dtfmt)
+                            updated_at_str = format_datetime(updated_at)
 
                         for col in _extra_columns:
-                            row.append(job.data.get(col, "-"))
+                            row.append(str(job.data.get(col, "-")))
 
                         row += [
                             batch_job_id,
-                            created_at.strftime(dtfmt),
+                            format_datetime(created_at),
                             updated_at_str,
                             status_name,
                         ]
 
-                        rows.append(tuple(click.style(c, fg=color) for c in row))
+                        rows.append(tuple(row))
+                        row_colors.append(status_color(job.status))
 
-                click.echo(format_table(tuple(headers), rows, align=tuple(align)))
+                click.echo(
+                    format_table(
+                        tuple(headers), rows, align=tuple(align), row_colors=row_colors
+                    )
+                )
 
                 if show_sizes:
                     click.echo(
@@ -341,9 +417,6 @@ class Repl(cmd.Cmd):
 
         except pw.DoesNotExist:
             click.secho(f"Folder {dir} does not exist", fg="red")
-        finally:
-            if ex is not None:
-                ex.shutdown()
 
     @parse_arguments
     @click.argument("path")
@@ -428,6 +501,7 @@ class Repl(cmd.Cmd):
         jobs = self.state.get_jobs(path, recursive)
         if refresh:
             jobs = list(self.state.refresh_jobs(jobs))
+        jobs = Job.prefetch_folders(jobs)
 
         for job in jobs:
             click.echo(job)
@@ -443,7 +517,7 @@ class Repl(cmd.Cmd):
             ):
                 fg: Optional[str] = None
                 if field == "status":
-                    fg = color_dict[job.status]
+                    fg = status_color(job.status)
                 if field == "folder":
                     click.echo(f"folder: {job.folder.path}")
                     continue
@@ -513,18 +587,16 @@ class Repl(cmd.Cmd):
         command_str = " ".join(command)
 
         logger.debug("Raw extra arguments: %s", arguments_raw)
-        arg_str: Dict[str, str] = dict(
-            [cast(Tuple[str, str], s.split("=", 1)) for s in arguments_raw]
-        )
-
-        # cast to int for numeric values
-        # @TODO: This might need to be smarter at some point
         arguments: Dict[str, Union[str, int]] = {}
-        for k, v in arg_str.items():
-            if v.isdigit():
-                arguments[k] = int(v)
-            else:
-                arguments[k] = v
+        for arg in arguments_raw:
+            k, sep, v = arg.partition("=")
+            if sep == "":
+                raise click.BadParameter(
+                    f"'{arg}' is not of the form name=value", param_hint="'--argument'"
+                )
+            # cast to int for numeric values
+            # @TODO: This might need to be smarter at some point
+            arguments[k] = int(v) if v.isdecimal() else v
 
         logger.debug("Got extra arguments: %s", arguments)
 
@@ -582,7 +654,7 @@ class Repl(cmd.Cmd):
 
             output = ""
             for k, c in counts.items():
-                output += style(f" {c:> 6d}{k.name[:1]}", fg=color_dict[k])
+                output += style_status(f" {c:> 6d}{k.name[:1]}", k)
 
             click.echo(output)
 
@@ -600,8 +672,6 @@ class Repl(cmd.Cmd):
         Tail the stdout of the job at PATH.
         Will wait for the creation of the stdout file if it hasn't already been created.
         """
-        from sh import tail  # type: ignore
-
         jobs = self.state.get_jobs(path)
         assert len(jobs) == 1
         job = jobs[0]
@@ -612,35 +682,40 @@ class Repl(cmd.Cmd):
             with Spinner(
                 text=f"Waiting for job to create stdout file '{job.data['stdout']}'"
             ):
-                while not os.path.exists(job.data["stdout"]):
-                    time.sleep(1)
+                wait_for_path(job.data["stdout"])
                 logger.info("Outfile exists now")
 
         width, _ = shutil.get_terminal_size((80, 40))
         hw = width // 2
         click.echo("=" * hw + " STDOUT " + "=" * (width - hw - 8))
 
-        def show(line: str) -> None:  # pragma: no cover
-            sys.stdout.write(line)
-
+        proc = subprocess.Popen(
+            ["tail", "-n", str(number_of_lines), "-f", job.data["stdout"]],
+            stdout=subprocess.PIPE,
+        )
         try:
-            proc = tail(
-                "-n",
-                number_of_lines,
-                "-f",
-                job.data["stdout"],
-                _bg=True,
-                _bg_exc=False,
-                _out=show,
-            )
-            try:
-                proc.wait()
-            except KeyboardInterrupt:  # pragma: no cover
-                proc.terminate()
-                proc.wait()
-
-        except sh.SignalException_SIGTERM:  # pragma: no cover
+            assert proc.stdout is not None
+            fd = proc.stdout.fileno()
+            out = getattr(sys.stdout, "buffer", None)
+            sys.stdout.flush()
+            # pass on whatever is available, in large blocks instead of lines.
+            # os.read returns as soon as there is any data.
+            while True:
+                buf = os.read(fd, 65536)
+                if not buf:
+                    break
+                if out is not None:
+                    out.write(buf)
+                    out.flush()
+                else:  # pragma: no cover
+                    sys.stdout.write(buf.decode(errors="replace"))
+        except KeyboardInterrupt:  # pragma: no cover
             pass
+        finally:
+            proc.terminate()
+            proc.wait()
+            if proc.stdout is not None:
+                proc.stdout.close()
 
     @parse_arguments
     @click.argument("path")
@@ -651,12 +726,14 @@ class Repl(cmd.Cmd):
         job = jobs[0]
 
         def reader() -> Iterable[str]:
-            with open(job.data["stdout"]) as fp:
-                line = fp.readline()
-                yield line
-                while line:
-                    line = fp.readline()
-                    yield line
+            # hand the pager large blocks, not individual lines. Text mode
+            # takes care of multi-byte characters split across blocks.
+            with open(job.data["stdout"], errors="replace") as fp:
+                while True:
+                    buf = fp.read(65536)
+                    if not buf:
+                        return
+                    yield buf
 
         click.echo_via_pager(reader())
 
@@ -751,7 +828,13 @@ class Repl(cmd.Cmd):
         env = os.environ.copy()
         env.update({"KONG_PWD": self.state.cwd.path})
         logger.debug("Expanded: %s", cmd)
-        subprocess.run(cmd, shell=True, env=env)
+        proc = subprocess.Popen(cmd, shell=True, env=env)
+        try:
+            proc.wait()
+        except KeyboardInterrupt:
+            # leave the REPL running, only the command is interrupted
+            proc.send_signal(signal.SIGINT)
+            proc.wait()
 
     def do_exit(self, arg: str) -> bool:
         """Exit the repl"""
@@ -761,15 +844,80 @@ class Repl(cmd.Cmd):
         """Helper command to handle Ctrl+D"""
         return self.do_exit(arg)
 
+    def _save_history(self, rewrite: bool = False) -> None:
+        if not self._use_readline:
+            return
+        length = readline.get_current_history_length()
+        new_entries = length - self._history_saved_length
+        self._commands_since_rewrite += 1
+
+        append = getattr(readline, "append_history_file", None)
+        if (
+            not rewrite
+            and append is not None
+            and self._commands_since_rewrite < self.history_rewrite_interval
+        ):
+            # no exists() check up front, that would cost a stat per command
+            try:
+                if new_entries > 0:
+                    append(new_entries, history_file)
+                self._history_saved_length = length
+                return
+            except FileNotFoundError:
+                # no history file yet, write it fully
+                pass
+
+        # also truncates the file to the configured history length
+        readline.write_history_file(history_file)
+        self._commands_since_rewrite = 0
+        self._history_saved_length = length
+
     def preloop(self) -> None:
+        if not self._use_readline:
+            return
+        history_length = self.state.config.history_length
+        readline.set_history_length(history_length)
         if os.path.exists(history_file):
             # logger.debug("Loading history from %s", history_file)
-            readline.read_history_file(history_file)
+            if "libedit" in (readline.__doc__ or "") or history_length < 0:
+                # libedit's file format is not line based
+                readline.read_history_file(history_file)
+            else:
+                # only load what would be kept anyway, the file can be longer
+                # since it's only truncated periodically
+                for line in tail_lines(history_file, history_length):
+                    readline.add_history(line)
         else:
             logger.debug("No history file found")
+        self._history_saved_length = readline.get_current_history_length()
 
     def postloop(self) -> None:
-        pass
+        self._save_history(rewrite=True)
+        if self._io_pool is not None:
+            self._io_pool.shutdown()
+            self._io_pool = None
+
+    def _job_size(self, job: Job) -> int:
+        if job.status not in (Job.Status.COMPLETED, Job.Status.FAILED):
+            # output of unfinished jobs can still change
+            return job.size()
+        key = (job.job_id, job.updated_at)
+        size = self._size_cache.get(key)
+        if size is None:
+            size = job.size()
+            if len(self._size_cache) >= self.size_cache_max:
+                self._size_cache.clear()
+            self._size_cache[key] = size
+        return size
+
+    def _get_io_pool(self) -> ThreadPoolExecutor:
+        if self._io_pool is None:
+            # stat calls are I/O bound, more threads than cores pay off
+            self._io_pool = ThreadPoolExecutor(
+                max_workers=min(64, (os.cpu_count() or 4) * 8),
+                thread_name_prefix="kong-io",
+            )
+        return self._io_pool
 
     def cmdloop(self, intro: Optional[Any] = None) -> Any:
         print(self.intro)
@@ -12,8 +12,7 @@ from .drivers import get_driver
 
 def setup(cfg: Optional[config.Config]) -> None:
     logger.debug("Running setup")
-    if not os.path.exists(config.APP_DIR):
-        os.makedirs(config.APP_DIR)
+    os.makedirs(config.APP_DIR, exist_ok=True)
 
     data: Dict[str, Any]
     if cfg is None:
@@ -40,8 +39,7 @@ def setup(cfg: Optional[config.Config]) -> None:
         )
     )
 
-    if not os.path.exists(data["jobdir"]):
-        os.makedirs(data["jobdir"])
+    os.makedirs(data["jobdir"], exist_ok=True)
 
     data["joboutputdir"] = os.path.expanduser(
         click.prompt(
@@ -50,8 +48,7 @@ def setup(cfg: Optional[config.Config]) -> None:
         )
     )
 
-    if not os.path.exists(data["joboutputdir"]):
-        os.makedirs(data["joboutputdir"])
+    os.makedirs(data["joboutputdir"], exist_ok=True)
 
     data["history_length"] = data.get("history_length")
 
@@ -59,4 +56,4 @@ def setup(cfg: Optional[config.Config]) -> None:
 
     logger.debug("Config: %s", data)
     with open(config.CONFIG_FILE, "w") as f:
-        yaml.dump(data, f)
+        yaml.dump(data, f, Dumper=config.YamlDumper)
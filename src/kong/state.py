@@ -3,7 +3,9 @@ from concurrent.futures import ThreadPoolExecutor
 
 import humanfriendly
 from datetime import timedelta
-from fnmatch import fnmatch
+from itertools import chain
+from collections import Counter
+from operator import attrgetter
 import os
 import re
 from typing import (
@@ -16,23 +18,38 @@ from typing import (
     Sequence,
     Iterable,
     Iterator,
+    Dict,
+    Type,
     cast,
 )
 
 import peewee as pw
 from contextlib import contextmanager
 
-from click import style
 
-from .util import Progress, Spinner, exhaust, strip_colors
+from .util import Progress, Spinner, chunks, exhaust, strip_colors
 from .drivers import DriverMismatch, get_driver
 from .drivers.driver_base import DriverBase
 from . import config
-from .db import database
+from .db import database, pragmas, cached_statements
 from .model.folder import Folder
-from .model.job import Job, color_dict
+from .model.job import Job, style_status
 from .logger import logger
 
+# job id ranges like 1111..9999, see State
+_job_range_regex = re.compile(r"(\d+)\.\.(\d+)$")
+
+
+def _is_job_id(spec: "JobSpec") -> bool:
+    return isinstance(spec, int) or (isinstance(spec, str) and spec.isdigit())
+
+
+def _count_statuses(jobs: Iterable[Job]) -> Dict["Job.Status", int]:
+    # every status is listed, in definition order, the tally itself runs in C
+    counts = {k: 0 for k in Job.Status}
+    counts.update(Counter(map(attrgetter("status"), jobs)))
+    return counts
+
 
 class CannotCreateError(RuntimeError):
     """
@@ -103,9 +120,10 @@ class State:
         """
         self.config = config
         self.cwd = cwd
-        self.default_driver: DriverBase = get_driver(self.config.default_driver)(
-            self.config
-        )
+        # driver instances by class, shared by all jobs handled by this state.
+        # constructed on first use, browsing commands never need a driver
+        self._drivers: Dict[Type[DriverBase], DriverBase] = {}
+        self._default_driver: Optional[DriverBase] = None
 
     @contextmanager  # type: ignore
     def pushd(self, folder: Union["Folder", str]) -> Iterator[None]:
@@ -144,16 +162,52 @@ class State:
         logger.debug(
             "Initializing database '%s' at '%s'", config.APP_NAME, config.DB_FILE
         )
-        database.init(config.DB_FILE)
+        database.init(
+            config.DB_FILE, pragmas=pragmas, cached_statements=cached_statements
+        )
 
         # ensure database is set up
         database.connect()
+        for model in (Job, Folder):
+            model.add_missing_columns()
         database.create_tables([Job, Folder])
+        Folder.backfill_cached_paths()
 
         cwd = Folder.get_root()
 
         return cls(cfg, cwd)
 
+    @property
+    def default_driver(self) -> DriverBase:
+        """
+        Instance of the driver configured as default, constructed on first access.
+        """
+        if self._default_driver is None:
+            self._default_driver = self._get_driver(
+                get_driver(self.config.default_driver)
+            )
+        return self._default_driver
+
+    def _get_driver(self, driver_class: Type[DriverBase]) -> DriverBase:
+        driver = self._drivers.get(driver_class)
+        if driver is None:
+            driver = driver_class(self.config)
+            self._drivers[driver_class] = driver
+        return driver
+
+    def _ensure_driver(self, job: Job) -> DriverBase:
+        """
+        Make sure `job` has a driver instance, reusing one instance per driver
+        class instead of constructing a new driver for every call.
+
+        :param job: The job to attach a driver instance to
+        :return: The driver instance of the job
+        """
+        if job._driver_instance is None:
+            # looked up by the job's driver class, so this always matches
+            job._driver_instance = self._get_driver(job.driver)
+        return job.driver_instance
+
     def refresh_jobs(self, jobs: List[Job]) -> Sequence[Job]:
         """
         Refresh a list of jobs and retrieve their current status.
@@ -166,23 +220,49 @@ class State:
         if len(jobs) == 0:
             return jobs
 
+        # sync in bulk per driver, so jobs of different drivers in one
+        # listing still take one batch query each
+        by_driver: Dict[Type[DriverBase], List[Job]] = {}
+        for job in jobs:
+            by_driver.setdefault(job.driver, []).append(job)
+
+        if len(by_driver) == 1:
+            return self._refresh_driver_jobs(jobs)
+
+        refreshed: Dict[int, Job] = {}
+        for driver_jobs in by_driver.values():
+            for job in self._refresh_driver_jobs(driver_jobs):
+                refreshed[job.job_id] = job
+        return [refreshed.get(job.job_id, job) for job in jobs]
+
+    def _refresh_driver_jobs(self, jobs: List[Job]) -> List[Job]:
         first_job: Job = jobs[0]
         # try bulk refresh first
-        first_job.ensure_driver_instance(self.config)
-        driver: DriverBase = first_job.driver_instance
+        driver: DriverBase = self._ensure_driver(first_job)
         try:
             logger.debug("Attempting bulk mode sync using %s", driver.__class__)
             jobs = list(driver.bulk_sync_status(jobs))
         except DriverMismatch:
-            # fall back to slow mode
-            logger.debug("Bulk mode sync failed, falling back to slow loop mode")
+            # fall back to syncing with the driver instance of every job,
+            # still in bulk for all jobs sharing an instance
+            logger.debug("Bulk mode sync failed, syncing per driver instance")
+            groups: Dict[int, Tuple[DriverBase, List[Job]]] = {}
             for job in jobs:
-                job.ensure_driver_instance(self.config)
-                job.get_status()
+                instance = self._ensure_driver(job)
+                groups.setdefault(id(instance), (instance, []))[1].append(job)
+            synced: Dict[int, Job] = {}
+            for instance, group in groups.values():
+                for job in instance.bulk_sync_status(group):
+                    synced[job.job_id] = job
+            jobs = [synced.get(job.job_id, job) for job in jobs]
         return jobs
 
     def ls(
-        self, path: str = ".", refresh: bool = False, recursive: bool = False
+        self,
+        path: str = ".",
+        refresh: bool = False,
+        recursive: bool = False,
+        status: Optional["Job.Status"] = None,
     ) -> Tuple[List["Folder"], List["Job"]]:
         """
         Lists the current directory content.
@@ -190,23 +270,33 @@ class State:
         :param path: The path to list the content for
         :param refresh: FLag to indicate whether job statuses should be refreshed
         :param recursive: Descend into the folder hierarchy to find all jobs to list
+        :param status: Only list jobs with this status (after refreshing)
         :return: List of folders and list of jobs found
         """
 
-        logger.debug("%s", list(self.cwd.children))
         folder = Folder.find_by_path(path, self.cwd)
         if folder is None:
             raise pw.DoesNotExist()
 
+        # a refresh can change the status, filter afterwards in that case
+        query_status = status if not refresh else None
+        query: Iterable[Job]
         if recursive:
-            jobs = folder.jobs_recursive()
+            query = folder.jobs_recursive(status=query_status)
+        elif query_status is not None:
+            query = folder.jobs.where(Job.status == query_status)  # type: ignore
         else:
-            jobs = folder.jobs
+            query = folder.jobs
+
+        # the rows are read only once, skip peewee's result cache
+        jobs: List[Job] = list(query.iterator())  # type: ignore
 
         if refresh:
-            jobs = self.refresh_jobs(list(jobs))
+            jobs = list(self.refresh_jobs(jobs))
+            if status is not None:
+                jobs = [job for job in jobs if job.status == status]
 
-        return list(folder.children), list(jobs)
+        return list(folder.children), jobs
 
     def cd(self, target: Union[str, Folder] = ".") -> None:
         """
@@ -256,6 +346,9 @@ class State:
         else:
             raise TypeError(f"{dest} is neither string nor Folder")
 
+        # the cwd path might have changed with the move
+        self.cwd.reload()
+
     def _mv_folders(self, folders: List[Folder], dest: Union[str, Folder]) -> None:
         dest_folder: Folder
         if isinstance(dest, Folder):
@@ -267,11 +360,21 @@ class State:
         else:
             raise TypeError(f"{dest} is neither string nor Folder")
 
+        now = datetime.datetime.now()
+        ids = [f.folder_id for f in folders if f != dest_folder]
         with database.atomic():
-            Folder.update(parent=dest_folder, updated_at=datetime.datetime.now()).where(
-                Folder.folder_id  # type: ignore
-                << [f.folder_id for f in folders if f != dest_folder]  # type: ignore
-            ).execute()
+            # stay below sqlite's limit on bound parameters
+            for chunk in chunks(ids, 500):
+                Folder.update(parent=dest_folder, updated_at=now).where(
+                    Folder.folder_id << chunk  # type: ignore
+                ).execute()
+            for folder in folders:
+                if folder == dest_folder:
+                    continue
+                folder.parent = dest_folder
+                folder.refresh_path()
+
+        self.cwd.reload()
 
     def _mv_jobs(self, jobs: List[Job], dest: Union[str, Folder]) -> None:
         dest_folder: Optional[Folder]
@@ -286,10 +389,13 @@ class State:
 
         assert dest_folder is not None
 
+        now = datetime.datetime.now()
         with database.atomic():
-            Job.update(folder=dest_folder, updated_at=datetime.datetime.now()).where(
-                Job.job_id << [j.job_id for j in jobs]  # type: ignore
-            ).execute()
+            # stay below sqlite's limit on bound parameters
+            for chunk in chunks([j.job_id for j in jobs], 500):
+                Job.update(folder=dest_folder, updated_at=now).where(
+                    Job.job_id << chunk  # type: ignore
+                ).execute()
 
     def mv(
         self, source: Union[str, Job, Folder], dest: Union[str, Folder]
@@ -328,6 +434,15 @@ class State:
                 if len(folders) == 0 and len(jobs) == 0:
                     raise DoesNotExist(f"No such folder or job: {source}")
 
+                if isinstance(dest, str):
+                    # resolve once for both jobs and folders
+                    dest_folder = Folder.find_by_path(dest, self.cwd)
+                    if dest_folder is None:
+                        raise ValueError(
+                            f"{dest} does not exists, and jobs cannot be renamed"
+                        )
+                    dest = dest_folder
+
                 self._mv_jobs(jobs, dest)
                 self._mv_folders(folders, dest)
 
@@ -367,28 +482,31 @@ class State:
 
         head, tail = os.path.split(path)
 
-        if create_parent and head != "":
-
-            def create(p: str) -> Folder:
-                head, tail = os.path.split(p)
-                loc = Folder.find_by_path(head, self.cwd)
-                if loc is None:
-                    loc = create(head)
-                subf = loc.subfolder(tail)
-                if subf is not None:
-                    return subf
-                return Folder.create(name=tail, parent=loc)
-
-            location = create(head)
-        else:
-            location = Folder.find_by_path(head, self.cwd)
+        with database.atomic():
+            if create_parent and head != "":
+                parts = [p for p in head.split("/") if p not in ("", ".")]
+                # find the deepest ancestor that exists, then create the rest
+                idx = len(parts)
+                while idx > 0:
+                    location = Folder.find_by_path("/".join(parts[:idx]), self.cwd)
+                    if location is not None:
+                        break
+                    idx -= 1
+                else:
+                    location = self.cwd
+                for name in parts[idx:]:
+                    location = Folder.create(name=name, parent=location)
+            else:
+                location = Folder.find_by_path(head, self.cwd)
 
-        if location is None:
-            raise CannotCreateError(f"Cannot create folder at '{path}'")
+            if location is None:
+                raise CannotCreateError(f"Cannot create folder at '{path}'")
 
-        logger.debug("Attempt to create folder named '%s' in '%s'", tail, location.path)
+            logger.debug(
+                "Attempt to create folder named '%s' in '%s'", tail, location.path
+            )
 
-        return Folder.create(name=tail, parent=location)
+            return Folder.create(name=tail, parent=location)
 
     def rm(
         self,
@@ -420,8 +538,7 @@ class State:
                     raise CannotRemoveIsFolder(
                         f"{name} matches {len(folders)} folder(s). Use recursive to delete"
                     )
-                for folder in folders:
-                    jobs += list(folder.jobs_recursive())
+                jobs += self._jobs_recursive(folders)
             except ValueError:
                 pass
 
@@ -430,7 +547,8 @@ class State:
             except ValueError:
                 pass
 
-            jobs = list(set(jobs))
+            # dedup by id, keeps the order jobs were found in
+            jobs = list({j.job_id: j for j in jobs}.values())
 
             if len(folders) == 0 and len(jobs) == 0:
                 raise DoesNotExist(f"No such folder or job: {name}")
@@ -439,8 +557,7 @@ class State:
 
                 if len(jobs) > 0:
                     first_job = jobs[0]
-                    first_job.ensure_driver_instance(self.config)
-                    driver = first_job.driver_instance
+                    driver = self._ensure_driver(first_job)
 
                     with ThreadPoolExecutor(threads) as ex:
                         for _ in Progress(
@@ -450,11 +567,13 @@ class State:
                         ):
                             pass
 
-                    with Spinner(f"Removing {len(jobs)} jobs"):
-                        driver.bulk_remove(jobs, do_cleanup=False)
+                # the database rows of jobs and folders go in one transaction
+                with database.atomic():
+                    if len(jobs) > 0:
+                        with Spinner(f"Removing {len(jobs)} jobs"):
+                            driver.bulk_remove(jobs, do_cleanup=False)
 
-                for folder in folders:
-                    folder.delete_instance(recursive=True, delete_nullable=True)
+                    Folder.delete_recursive_bulk([f.folder_id for f in folders])
 
                 return True
 
@@ -464,7 +583,7 @@ class State:
 
             if confirm(f"Delete job {job}?"):
                 # need driver instance
-                job.ensure_driver_instance(self.config)
+                self._ensure_driver(job)
                 job.driver_instance.remove(job)
                 return True
             return False
@@ -477,8 +596,7 @@ class State:
             if confirm(f"Delete folder {folder.path} and {len(jobs)} jobs?"):
                 if len(jobs) > 0:
                     first_job = jobs[0]
-                    first_job.ensure_driver_instance(self.config)
-                    driver = first_job.driver_instance
+                    driver = self._ensure_driver(first_job)
 
                     with ThreadPoolExecutor(threads) as ex:
                         for _ in Progress(
@@ -488,10 +606,13 @@ class State:
                         ):
                             pass
 
-                    with Spinner(f"Removing {len(jobs)} jobs"):
-                        driver.bulk_remove(jobs, do_cleanup=False)
+                # the database rows of jobs and folders go in one transaction
+                with database.atomic():
+                    if len(jobs) > 0:
+                        with Spinner(f"Removing {len(jobs)} jobs"):
+                            driver.bulk_remove(jobs, do_cleanup=False)
 
-                folder.delete_instance(recursive=True, delete_nullable=True)
+                    Folder.delete_recursive_bulk([folder.folder_id])
                 return True
             return False
         else:
@@ -533,7 +654,7 @@ class State:
                 head, tail = os.path.split(name)
                 logger.debug("Getting job: head: %s, tail: %s", head, tail)
 
-                r_m = re.match(r"(\d+)\.\.(\d+)", tail)
+                r_m = _job_range_regex.match(tail)
 
                 if tail.isdigit():
                     # single job id, just get that
@@ -546,7 +667,11 @@ class State:
                     # this is half-recursive right now
                     # folder = Folder.find_by_path(self.cwd, head)
                     folders = self.get_folders(head)
-                    jobs = sum([list(f.jobs) for f in folders], [])
+                    jobs = list(
+                        chain.from_iterable(
+                            f.jobs.iterator() for f in folders  # type: ignore
+                        )
+                    )
                 elif r_m is not None:
                     start = int(r_m.group(1))
                     end = int(r_m.group(2))
@@ -557,20 +682,17 @@ class State:
                     folder = Folder.find_by_path(head, self.cwd)
                     assert folder is not None
 
-                    jobs = []
-                    for job in folder.jobs:
-                        if job.job_id < start or job.job_id > end:
-                            continue
-                        jobs.append(job)
-                    return jobs
+                    in_range = Job.job_id.between(start, end)  # type: ignore
+                    query = folder.jobs.where(in_range)  # type: ignore
+                    return list(query.order_by(Job.job_id))
                 else:
                     folder = Folder.find_by_path(name, self.cwd)
                     if folder is None:
                         raise ValueError(f"{name} jobspec is not understood")
                     if recursive:
-                        jobs = list(folder.jobs_recursive())
+                        jobs = list(folder.jobs_recursive().iterator())  # type: ignore
                     else:
-                        jobs = folder.jobs
+                        jobs = list(folder.jobs.iterator())  # type: ignore
         elif isinstance(name, Job):
             jobs = [name]
         else:
@@ -596,17 +718,19 @@ class State:
             # get folders, extract jobs from those
             folders = self.get_folders(name)
             logger.debug("Recursive, found %s folders", len(folders))
-            jobs = sum([list(f.jobs_recursive()) for f in folders], [])
+            jobs = self._jobs_recursive(folders)
         else:
             jobs = self._extract_jobs(name)
 
+        if len(jobs) == 0:
+            logger.debug("No jobs selected, nothing to submit")
+            return
+
         if not confirm(f"Submit {len(jobs)} jobs?"):
             return
 
-        assert len(jobs) > 0
         first_job = jobs[0]
-        first_job.ensure_driver_instance(self.config)
-        driver = first_job.driver_instance
+        driver = self._ensure_driver(first_job)
 
         def job_iter() -> Iterable[Job]:
             job: Job
@@ -616,7 +740,11 @@ class State:
         driver.bulk_submit(job_iter())
 
     def kill_job(
-        self, name: JobSpec, recursive: bool = False, confirm: Confirmation = YES
+        self,
+        name: JobSpec,
+        recursive: bool = False,
+        confirm: Confirmation = YES,
+        threads: Optional[int] = os.cpu_count(),
     ) -> None:
         """
         Terminate execution of one or more jobs.
@@ -625,6 +753,7 @@ class State:
         :param confirm: Confirmation callback. Defaults to YES
         :param recursive: If `True`, will recursively select jobs for termination.
                           Required if `path` is a n actual path.
+        :param threads: Number of threads to use to kill jobs in parallel
         """
 
         jobs: List[Job]
@@ -633,17 +762,29 @@ class State:
             # get folders, extract jobs from thos
             folders = self.get_folders(name)
             logger.debug("Recursive, found %s folders", len(folders))
-            jobs = sum([list(f.jobs_recursive()) for f in folders], [])
+            jobs = self._jobs_recursive(folders)
         else:
             jobs = self._extract_jobs(name)
 
+        if len(jobs) == 0:
+            logger.debug("No jobs selected, nothing to kill")
+            return
+
         if not confirm(f"Kill {len(jobs)}?"):
             return
-        job: Job
-        for job in Progress(jobs, desc="Killing jobs"):
 
-            job.ensure_driver_instance(self.config)  # type: ignore
-            job.kill()  # type: ignore
+        # jobs can belong to different drivers, kill in bulk per driver
+        by_driver: Dict[Type[DriverBase], List[Job]] = {}
+        for job in jobs:
+            by_driver.setdefault(job.driver, []).append(job)
+
+        for driver_jobs in by_driver.values():
+            first_job = driver_jobs[0]
+            self._ensure_driver(first_job)
+            with Spinner(f"Killing {len(driver_jobs)} jobs"), ThreadPoolExecutor(
+                threads
+            ) as ex:
+                first_job.driver_instance.bulk_kill(driver_jobs, ex=ex)
 
     def resubmit_job(
         self,
@@ -671,13 +812,15 @@ class State:
         if failed_only:
             jobs = [job for job in jobs if job.status == Job.Status.FAILED]
 
+        if len(jobs) == 0:
+            logger.debug("No jobs selected, nothing to resubmit")
+            return
+
         if not confirm(f"Resubmit {len(jobs)} jobs?"):
             return
 
-        assert len(jobs) > 0
         first_job = jobs[0]
-        first_job.ensure_driver_instance(self.config)
-        driver = first_job.driver_instance
+        driver = self._ensure_driver(first_job)
 
         with Spinner(f"Preparing for resubmission for {len(jobs)} jobs"):
             jobs = list(driver.bulk_resubmit(jobs, do_submit=False))
@@ -700,6 +843,12 @@ class State:
         """
         return self._extract_jobs(name, recursive)
 
+    @staticmethod
+    def _jobs_recursive(folders: List[Folder]) -> List[Job]:
+        # one recursive query for all folders, instead of one per folder
+        jobs = Folder.jobs_recursive_bulk([f.folder_id for f in folders])
+        return [job for f in folders for job in jobs[f.folder_id]]
+
     def get_folders(self, pattern: str) -> List[Folder]:
         """
         Helper method to select jobs from a pattern.
@@ -723,8 +872,11 @@ class State:
             if tail == "*":  # no need to match, just get all
                 return folder.children
             else:
-                folders = [f for f in folder.children if fnmatch(f.name, tail)]
-                return folders
+                # match in sqlite, GLOB has fnmatch's syntax except for the
+                # negated character class
+                glob = tail.replace("[!", "[^")
+                query = folder.children.where(Folder.name % glob)  # type: ignore
+                return list(query.order_by(Folder.folder_id))
         else:
             folder = Folder.find_by_path(pattern, self.cwd)
             if folder is None:
@@ -776,17 +928,34 @@ class State:
         poll_interval: Optional[int] = None,
         update_interval: Optional[timedelta] = None,
     ) -> Iterable[List[Job]]:
+        # plain job ids are looked up in one go, other specs one by one
+        ids = [
+            int(cast(Union[int, str], spec)) for spec in jobspecs if _is_job_id(spec)
+        ]
+        by_id: Dict[int, Job] = {j.job_id: j for j in Job.bulk_select(Job.job_id, ids)}
+
         jobs: List[Job] = []
         for jobspec in jobspecs:
-            jobs.extend(self._extract_jobs(jobspec, recursive=recursive))
+            if _is_job_id(jobspec):
+                job = by_id.get(int(cast(Union[int, str], jobspec)))
+                if job is None:
+                    raise DoesNotExist(f"Did not find job with id {jobspec}")
+                jobs.append(job)
+            else:
+                jobs.extend(self._extract_jobs(jobspec, recursive=recursive))
+        # overlapping specs select the same job more than once
+        jobs = list({j.job_id: j for j in jobs}.values())
 
         logger.debug("Jobs for waiting: %s", jobs)
-        assert len(jobs) > 0
+        if len(jobs) == 0:
+            return
         first_job = jobs[0]
-        first_job.ensure_driver_instance(self.config)
-        driver = first_job.driver_instance
+        driver = self._ensure_driver(first_job)
         orig_jobs = jobs[:]
 
+        # the most recent instance of every job seen while waiting
+        latest: Dict[int, Job] = {}
+
         wait_start = datetime.datetime.now()
         last_update = datetime.datetime.now()
 
@@ -804,13 +973,11 @@ class State:
                         progress=True,
                     ),
                 ):
-                    counts = {k: 0 for k in Job.Status}
-                    for job in cur_jobs:
-                        counts[job.status] += 1
+                    latest.update((job.job_id, job) for job in cur_jobs)
+                    counts = _count_statuses(cur_jobs)
 
                     out = [
-                        style(f"{k.name[:1]}{v}", fg=color_dict[k])
-                        for k, v in counts.items()
+                        style_status(f"{k.name[:1]}{v}", k) for k, v in counts.items()
                     ]
                     s.text = f"Waiting for {len(jobs)} jobs: {', '.join(out)}"
 
@@ -827,10 +994,21 @@ class State:
 
                     yield cur_jobs
 
-            orig_jobs = list(driver.bulk_sync_status(orig_jobs))
-            counts = {k: 0 for k in Job.Status}
-            for job in orig_jobs:
-                counts[job.status] += 1
+            orig_jobs = [latest.get(job.job_id, job) for job in orig_jobs]
+            # the driver stops without yielding the poll that saw all jobs
+            # finish, only sync the jobs that were unfinished before that
+            unfinished = [
+                job
+                for job in orig_jobs
+                if job.status
+                not in (Job.Status.COMPLETED, Job.Status.FAILED, Job.Status.UNKNOWN)
+            ]
+            if len(unfinished) > 0:
+                synced = {
+                    job.job_id: job for job in driver.bulk_sync_status(unfinished)
+                }
+                orig_jobs = [synced.get(job.job_id, job) for job in orig_jobs]
+            counts = _count_statuses(orig_jobs)
 
             out = [f"{k.name[:1]}{v}" for k, v in counts.items()]
 
@@ -6,8 +6,11 @@ from typing import List, Tuple, Optional
 from .util import shorten
 
 
-def _do_align(s: str, align: str, width: int, padstr: str) -> str:
-    length = len(click.unstyle(s))
+def _do_align(
+    s: str, align: str, width: int, padstr: str, length: Optional[int] = None
+) -> str:
+    if length is None:
+        length = len(click.unstyle(s))
     if length > width:
         s = shorten(s, width)
 
@@ -29,29 +32,34 @@ def _format_row(
     aligns: Tuple[str, ...],
     max_width: Optional[int] = None,
     padstr: str = " ",
+    lengths: Optional[List[int]] = None,
 ) -> str:
     assert len(cols) == len(aligns), "Number of aligns must match columns"
+    if lengths is None:
+        lengths = [len(click.unstyle(c)) for c in cols]
     colstrs = ["" for _ in cols]
     stretch_col = None
     for idx, (col, width, align) in enumerate(zip(cols, widths, aligns)):
         if align.endswith("+"):
             stretch_col = idx
-            colstr = _do_align(col, align[:-1], width, padstr)
-        else:
-            colstr = _do_align(col, align, width, padstr)
+            if max_width is not None:
+                # aligned below, with the remaining width
+                continue
+            align = align[:-1]
 
-        colstrs[idx] = colstr
+        colstrs[idx] = _do_align(col, align, width, padstr, lengths[idx])
 
     if stretch_col is not None and max_width is not None:
-        total_len = sum(
-            len(click.unstyle(c)) for i, c in enumerate(colstrs) if i != stretch_col
-        ) + (len(cols) - 1) * len(padstr)
+        # every other column is padded (or shortened) to exactly its width
+        total_len = sum(w for i, w in enumerate(widths) if i != stretch_col) + (
+            len(cols) - 1
+        ) * len(padstr)
         align = aligns[stretch_col][:-1]
         width = max_width - total_len
 
         col = cols[stretch_col]
 
-        colstr = _do_align(col, align, width, padstr)
+        colstr = _do_align(col, align, width, padstr, lengths[stretch_col])
 
         colstrs[stretch_col] = colstr
 
@@ -63,31 +71,41 @@ def format_table(
     rows: List[Tuple[str, ...]],
     align: Tuple[str, ...],
     width: Optional[int] = None,
+    row_colors: Optional[List[Optional[str]]] = None,
 ) -> str:
     assert len(headers) == len(align), "Number of aligns must match columns"
+    assert row_colors is None or len(row_colors) == len(rows)
     if width is None and any("+" in a for a in align):
         width, _ = shutil.get_terminal_size((80, 40))
 
-    col_widths = [len(click.unstyle(h)) for h in headers]
-    for row in rows:
-        for idx, col in enumerate(row):
-            col_widths[idx] = max(col_widths[idx], len(click.unstyle(col)))
-
-    output = ""
-    output += _format_row(headers, col_widths, align, max_width=width) + "\n"
+    header_lengths = [len(click.unstyle(h)) for h in headers]
+    col_widths = list(header_lengths)
+    # measure every cell only once, unstyling is the expensive part
+    row_lengths = [[len(click.unstyle(col)) for col in row] for row in rows]
+    for lengths in row_lengths:
+        for idx, length in enumerate(lengths):
+            if length > col_widths[idx]:
+                col_widths[idx] = length
 
-    output += (
+    lines = [
+        _format_row(
+            headers, col_widths, align, max_width=width, lengths=header_lengths
+        ),
         _format_row(
             tuple(["" for _ in col_widths]),
             col_widths,
             align,
             max_width=width,
             padstr="-",
-        )
-        + "\n"
-    )
-
-    for row in rows:
-        output += _format_row(row, col_widths, align, max_width=width) + "\n"
-
-    return output[:-1]
+            lengths=[0] * len(col_widths),
+        ),
+    ]
+
+    for idx, (row, lengths) in enumerate(zip(rows, row_lengths)):
+        line = _format_row(row, col_widths, align, max_width=width, lengths=lengths)
+        if row_colors is not None and row_colors[idx] is not None:
+            # style the aligned row as a whole, not every single cell
+            line = click.style(line, fg=row_colors[idx])
+        lines.append(line)
+
+    return "\n".join(lines)
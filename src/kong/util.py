@@ -2,12 +2,15 @@ import logging
 import math
 import re
 import os
+import shlex
 import shutil
 import stat
+import subprocess
+import time
 from concurrent.futures._base import Executor, wait
 from datetime import timedelta
 import click
-from typing import Optional, Any, TypeVar, Iterable, Iterator, List
+from typing import Optional, Any, TypeVar, Iterable, Iterator, List, Union, Tuple
 import sys
 import contextlib
 from collections import deque
@@ -25,6 +28,19 @@ def strip_colors(string: str) -> str:
     return strip.sub("", string)
 
 
+_shell_quoting = re.compile(r"['\"\\]")
+_shell_word = re.compile(r"[^ \t\r\n]+")
+
+
+def split_args(string: str) -> List[str]:
+    # same result as shlex.split, but without setting up a lexer for the
+    # common case of no quotes or escapes. shlex only treats space, tab, CR
+    # and LF as whitespace, str.split would split on more.
+    if _shell_quoting.search(string) is None:
+        return _shell_word.findall(string)
+    return shlex.split(string)
+
+
 def ljust(string: str, width: int, fillchar: str = " ") -> str:
     length = len(strip_colors(string))
     return string + (width - length) * fillchar
@@ -35,6 +51,49 @@ def rjust(string: str, width: int, fillchar: str = " ") -> str:
     return (width - length) * fillchar + string
 
 
+class ShellCommand:
+    """
+    Minimal wrapper to call an external program. Keyword arguments are
+    translated to long options (``--key=value``, or ``--key`` for ``True``),
+    similar to :mod:`sh`, but the process is run directly via :mod:`subprocess`,
+    without TTY probing and background reader threads.
+    """
+
+    def __init__(self, name: str) -> None:
+        path = shutil.which(name)
+        if path is None:
+            raise FileNotFoundError(f"Command {name} not found")
+        self.path = path
+
+    def _argv(self, *args: Any, **kwargs: Any) -> List[str]:
+        argv = [self.path] + [str(a) for a in args]
+        for key, value in kwargs.items():
+            if value is True:
+                argv.append(f"--{key}")
+            elif value is not False and value is not None:
+                argv.append(f"--{key}={value}")
+        return argv
+
+    def _iter_lines(self, argv: List[str]) -> Iterator[str]:
+        with subprocess.Popen(
+            argv, stdout=subprocess.PIPE, universal_newlines=True, bufsize=1
+        ) as proc:
+            assert proc.stdout is not None
+            yield from proc.stdout
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, argv)
+
+    def __call__(
+        self, *args: Any, _iter: bool = False, **kwargs: Any
+    ) -> Union[str, Iterator[str]]:
+        argv = self._argv(*args, **kwargs)
+        if _iter:
+            return self._iter_lines(argv)
+        return subprocess.run(
+            argv, stdout=subprocess.PIPE, universal_newlines=True, check=True
+        ).stdout
+
+
 def make_executable(path: str) -> None:
     mode = os.stat(path).st_mode
     os.chmod(path, mode | stat.S_IEXEC)
@@ -45,6 +104,46 @@ def is_executable(path: str) -> bool:
     return (mode & stat.S_IEXEC) != 0
 
 
+def ensure_dir(path: str) -> None:
+    # a single mkdir is enough if the parent exists already, only walk
+    # the full path if it does not
+    try:
+        os.mkdir(path)
+    except FileExistsError:
+        pass
+    except FileNotFoundError:
+        os.makedirs(path, exist_ok=True)
+
+
+def tail_lines(path: str, n: int, block_size: int = 8192) -> List[str]:
+    # read blocks backwards from the end until enough lines are found,
+    # so the cost depends on n, not on the size of the file
+    if n <= 0:
+        return []
+    with open(path, "rb") as fh:
+        end = fh.seek(0, os.SEEK_END)
+        pos = end
+        data = b""
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(block_size, pos)
+            pos -= step
+            fh.seek(pos)
+            data = fh.read(step) + data
+    lines = data.decode(errors="replace").splitlines()
+    return lines[-n:]
+
+
+def wait_for_path(
+    path: str, initial_interval: float = 0.05, max_interval: float = 1.0
+) -> None:
+    # poll quickly at first, then back off. inotify does not see files
+    # created on other hosts of a shared filesystem, e.g. by a batch job
+    interval = initial_interval
+    while not os.path.exists(path):
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+
 def rmtree(path: str) -> None:
     # we'll try using shutil, and fall back to 'rm' if that fails
     try:
@@ -159,23 +258,60 @@ def exhaust(generator: Iterable[Any]) -> None:
     deque(generator, maxlen=0)
 
 
-def get_size(path: str, ex: Optional[Executor] = None) -> int:
-    size = 0
-    futures = []
-    for d, _, files in os.walk(path):
-        if ex is None:
-            size += sum([os.path.getsize(os.path.join(d, f)) for f in files])
-        else:
-            for f in files:
-                futures.append(ex.submit(os.path.getsize, os.path.join(d, f)))
-
-    if ex is not None:
-        wait(futures)
-        size = sum(f.result() for f in futures)
+def _scan_size(path: str) -> Tuple[int, List[str]]:
+    """
+    Sum up the sizes of the files directly inside ``path``.
 
+    :param path: The directory to scan
+    :return: Tuple of the total size and the subdirectories found
+    """
+    size = 0
+    subdirs = []
+    try:
+        it = os.scandir(path)
+    except OSError:
+        return 0, []
+    with it:
+        for entry in it:
+            try:
+                # is_dir/is_file are answered from the readdir buffer
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    size += entry.stat().st_size
+            except OSError:
+                pass
+    return size, subdirs
+
+
+def _tree_size(path: str) -> int:
+    size = 0
+    stack = [path]
+    while stack:
+        dir_size, subdirs = _scan_size(stack.pop())
+        size += dir_size
+        stack.extend(subdirs)
     return size
 
 
+def get_size(path: str, ex: Optional[Executor] = None) -> int:
+    """
+    Calculate the total size of all files below a directory.
+
+    :param path: The directory to walk
+    :param ex: An executor like `concurrent.futures.Executor`. If given, the
+               top level subdirectories are walked in parallel, otherwise serially.
+    :return: Size in bytes
+    """
+    if ex is None:
+        return _tree_size(path)
+
+    size, subdirs = _scan_size(path)
+    futures = [ex.submit(_tree_size, d) for d in subdirs]
+    wait(futures)
+    return size + sum(f.result() for f in futures)
+
+
 def set_verbosity(verbosity: int) -> None:
     if verbosity == 0:
         level = logging.WARNING
@@ -2,6 +2,7 @@ import os
 import shutil
 from datetime import timedelta, datetime, date
 from typing import Collection, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import Mock, ANY, call
 
 import pytest
@@ -508,12 +509,42 @@ def test_sync_status(driver, monkeypatch):
 
 def test_bulk_create(driver, state):
     root = Folder.get_root()
+    # existing jobs offset the ids of the inserted ones
+    existing = [driver.create_job(folder=root, command="true") for _ in range(5)]
+    existing_data = {j.job_id: j.data for j in existing}
+
     jobs = driver.bulk_create_jobs(
         [{"folder": root, "command": "sleep 1"} for i in range(10)]
     )
     assert len(jobs) == 10
+    assert len({j.job_id for j in jobs} | set(existing_data)) == 15
+    for job in existing:
+        job = Job.get_by_id(job.job_id)
+        assert job.command == "true"
+        assert job.data == existing_data[job.job_id]
     for job in jobs:
+        assert job.command == "sleep 1"
         assert job.status == Job.Status.CREATED
+        assert os.path.exists(job.data["batchfile"])
+        assert is_executable(job.data["jobscript"])
+        with open(job.data["jobscript"]) as fh:
+            assert f"KONG_JOB_ID={job.job_id}" in fh.read()
+
+    jobs = driver.bulk_create_jobs(
+        [
+            {"folder": root, "command": f"sleep {i}", "cores": i, "name": f"j{i}"}
+            for i in range(1, 4)
+        ]
+    )
+    for i, job in enumerate(jobs, start=1):
+        job = Job.get_by_id(job.job_id)
+        assert job.command == f"sleep {i}"
+        assert job.cores == i and job.memory == 1000
+        assert job.driver == SlurmDriver
+        assert job.data["name"] == f"j{i}"
+        assert job.data["queue"] == driver.slurm_config["default_queue"]
+        with open(job.data["batchfile"]) as fh:
+            assert f"#SBATCH -c {i}\n" in fh.read()
 
 
 def test_bulk_submit(driver, state, monkeypatch):
@@ -604,6 +635,58 @@ def test_bulk_sync_status(driver, state, monkeypatch):
         assert job.status == Job.Status.FAILED
 
 
+def test_bulk_sync_status_data(driver, state, monkeypatch):
+    root = Folder.get_root()
+
+    jobs = driver.bulk_create_jobs(
+        [{"folder": root, "command": "sleep 1"} for i in range(4)]
+    )
+    monkeypatch.setattr(driver.slurm, "sbatch", Mock(side_effect=[1, 2, 3, 4]))
+    driver.bulk_submit(jobs)
+
+    SAI = SlurmAccountingItem
+    sacct_return = [
+        SAI(1, Job.Status.RUNNING, 0, {}),
+        SAI(2, Job.Status.RUNNING, 0, {"node": "z0021"}),
+        SAI(3, Job.Status.FAILED, 13, {}),
+        SAI(4, Job.Status.COMPLETED, 0, {}),
+    ]
+    monkeypatch.setattr(driver.slurm, "sacct", Mock(return_value=sacct_return))
+    jobs = driver.bulk_sync_status(jobs)
+
+    assert [j.status for j in jobs] == [
+        Job.Status.RUNNING,
+        Job.Status.RUNNING,
+        Job.Status.FAILED,
+        Job.Status.COMPLETED,
+    ]
+    assert jobs[1].data["node"] == "z0021"
+    assert jobs[2].data["exit_code"] == 13
+    assert "node" not in jobs[0].data
+
+
+def test_bulk_sync_status_terminal(driver, state, monkeypatch):
+    root = Folder.get_root()
+
+    jobs = driver.bulk_create_jobs(
+        [{"folder": root, "command": "sleep 1"} for i in range(4)]
+    )
+    for job, status in zip(jobs, [Job.Status.COMPLETED, Job.Status.FAILED] * 2):
+        job.status = status
+        job.save()
+
+    sacct = Mock(return_value=[])
+    monkeypatch.setattr(driver.slurm, "sacct", sacct)
+    res = driver.bulk_sync_status(jobs)
+    assert sacct.call_count == 0
+    assert res == jobs
+
+    jobs[0].status = Job.Status.RUNNING
+    jobs[0].save()
+    driver.bulk_sync_status(jobs)
+    assert sacct.call_count == 1
+
+
 def test_bulk_sync_status_invalid_id(driver, state, monkeypatch):
 
     root = Folder.get_root()
@@ -653,6 +736,24 @@ def test_kill_job(driver, state, monkeypatch):
     assert j1.status == Job.Status.FAILED
 
 
+def test_bulk_submit_partial_failure(driver, state, monkeypatch):
+    root = Folder.get_root()
+    jobs = [driver.create_job(folder=root, command="sleep 1") for _ in range(5)]
+
+    sbatch = Mock(side_effect=[1, 2, RuntimeError("sbatch failed")])
+    monkeypatch.setattr(driver.slurm, "sbatch", sbatch)
+    with pytest.raises(RuntimeError):
+        driver.bulk_submit(jobs)
+
+    for job in jobs:
+        job.reload()
+    # the jobs submitted before the failure are persisted
+    assert [j.batch_job_id for j in jobs[:2]] == ["1", "2"]
+    assert all(j.status == Job.Status.SUBMITTED for j in jobs[:2])
+    assert all(j.status == Job.Status.CREATED for j in jobs[2:])
+    assert all(j.batch_job_id is None for j in jobs[2:])
+
+
 def test_bulk_kill(driver, state, monkeypatch):
     root = Folder.get_root()
 
@@ -682,6 +783,39 @@ def test_bulk_kill(driver, state, monkeypatch):
 
     for job in jobs:
         assert job.status == Job.Status.FAILED
+        job.reload()
+        assert job.status == Job.Status.FAILED
+
+
+def test_bulk_kill_threaded(driver, state, monkeypatch):
+    root = Folder.get_root()
+
+    jobs = [driver.create_job(folder=root, command="sleep 1") for i in range(10)]
+
+    monkeypatch.setattr(
+        driver.slurm, "sbatch", Mock(side_effect=[i for i in range(len(jobs))])
+    )
+    driver.bulk_submit(jobs)
+    monkeypatch.setattr(driver.slurm, "sacct", Mock(return_value=[]))
+
+    def scancel(job):
+        if job.batch_job_id == "3":
+            raise RuntimeError("scancel failed")
+
+    monkeypatch.setattr(driver.slurm, "scancel", Mock(side_effect=scancel))
+
+    with ThreadPoolExecutor(4) as ex:
+        with pytest.raises(RuntimeError, match="scancel failed"):
+            driver.bulk_kill(jobs, ex=ex)
+
+    assert driver.slurm.scancel.call_count == len(jobs)
+    # every other kill went through and was persisted
+    for job in jobs:
+        job.reload()
+        if job.batch_job_id == "3":
+            assert job.status == Job.Status.SUBMITTED
+        else:
+            assert job.status == Job.Status.FAILED
 
 
 def test_wait(driver, state, monkeypatch):
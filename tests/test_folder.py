@@ -1,4 +1,5 @@
 import os
+from unittest.mock import patch
 
 import pytest
 import peewee as pw
@@ -50,6 +51,51 @@ def test_cannot_be_own_parent(db):
     f1.reload()
     assert f1.parent == root
 
+    # saving doesn't need to load the parent folder instance
+    f1 = Folder.get_by_id(f1.folder_id)
+    f1.name = "f1x"
+    with patch.object(Folder, "get", side_effect=AssertionError("loaded parent")):
+        f1.save()
+    assert Folder.get_by_id(f1.folder_id).path == "/f1x"
+
+
+def test_add_folder_tree(db):
+    root = Folder.get_root()
+    f1 = root.add_folder("f1")
+
+    created = f1.add_folder_tree({"a": {"b": {"c": None}, "d": {}}, "e": None})
+    assert sorted(f.path for f in created) == [
+        "/f1/a",
+        "/f1/a/b",
+        "/f1/a/b/c",
+        "/f1/a/d",
+        "/f1/e",
+    ]
+    c = Folder.find_by_path("/f1/a/b/c")
+    assert c.parent == Folder.find_by_path("/f1/a/b")
+    assert c.updated_at is not None
+    assert set(f1.folders_recursive()) == set(created)
+
+    with pytest.raises(pw.IntegrityError):
+        f1.add_folder_tree({"x": None, "a": None})
+    assert Folder.find_by_path("/f1/x") is None
+    with pytest.raises(AssertionError):
+        f1.add_folder_tree({"4": None})
+
+    assert f1.add_folder_tree({}) == []
+
+
+def test_bulk_insert(db):
+    root = Folder.get_root()
+    rows = [dict(name=f"f{i}", parent=root, cached_path=f"/f{i}") for i in range(250)]
+    ids = Folder.bulk_insert(rows)
+    assert len(ids) == 250
+    for i, folder_id in enumerate(ids):
+        folder = Folder.get_by_id(folder_id)
+        assert folder.name == f"f{i}"
+        assert folder.parent == root
+    assert Folder.bulk_insert(rows[:0]) == []
+
 
 def test_create_name_unique(db):
     root = Folder.get_root()
@@ -126,6 +172,96 @@ def test_path(db):
     assert f4.path == "/f1/f2/f4"
 
 
+def test_cached_path(db):
+    root = Folder.get_root()
+    assert root.cached_path == "/"
+
+    f1 = root.add_folder("f1")
+    f2 = f1.add_folder("f2")
+    f3 = f2.add_folder("f3")
+    other = root.add_folder("other")
+    assert f3.cached_path == "/f1/f2/f3"
+
+    # rename propagates to descendants
+    f1.name = "f1x"
+    f1.save()
+    f2.reload()
+    f3.reload()
+    assert f2.path == "/f1x/f2"
+    assert f3.path == "/f1x/f2/f3"
+
+    # move propagates to descendants
+    f2.parent = other
+    f2.save()
+    f3.reload()
+    assert f3.path == "/other/f2/f3"
+    f1.reload()
+    assert f1.path == "/f1x"
+
+    # bulk update of the parent, then refresh
+    Folder.update(parent=root).where(Folder.folder_id == f2.folder_id).execute()
+    f2.parent = root
+    f2.refresh_path()
+    f3.reload()
+    assert f2.path == "/f2"
+    assert f3.path == "/f2/f3"
+
+    assert Folder.find_by_path("/f2/f3") == f3
+    assert Folder.find_by_path("/other/f2/f3") is None
+
+
+def test_backfill_cached_paths(db):
+    root = Folder.get_root()
+    f1 = root.add_folder("f1")
+    f2 = f1.add_folder("f2")
+    f3 = root.add_folder("f3")
+
+    # pretend these were created before the column existed
+    Folder.update(cached_path=None).execute()
+    assert f2.reload() is None and f2.cached_path is None
+    assert f2.path == "/f1/f2"
+
+    Folder.backfill_cached_paths()
+    for f, p in [(root, "/"), (f1, "/f1"), (f2, "/f1/f2"), (f3, "/f3")]:
+        f.reload()
+        assert f.cached_path == p
+
+    # no-op if all set
+    Folder.backfill_cached_paths()
+
+
+def test_path_deep_without_cache(db):
+    root = Folder.get_root()
+    depth = 1500  # deeper than the default recursion limit
+    tree = None
+    for i in reversed(range(depth)):
+        tree = {f"f{i}": tree}
+    root.add_folder_tree(tree)
+
+    Folder.update(cached_path=None).execute()
+    deepest = Folder.get(name=f"f{depth - 1}")
+    assert deepest.path == "/" + "/".join(f"f{i}" for i in range(depth))
+
+
+def test_add_missing_columns(db):
+    assert Folder.add_missing_columns() == []
+
+    # emulate a database from before the cached_path column
+    database.drop_tables([Folder])
+    database.execute_sql(
+        "CREATE TABLE folder (folder_id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, "
+        "name VARCHAR(255) NOT NULL, parent_id INTEGER, created_at DATETIME NOT NULL, "
+        "updated_at DATETIME NOT NULL)"
+    )
+    assert Folder.add_missing_columns() == ["cached_path"]
+    assert "cached_path" in [c.name for c in database.get_columns("folder")]
+    assert "folder_cached_path" in [i.name for i in database.get_indexes("folder")]
+    database.create_tables([Folder])
+
+    root = Folder.get_root()
+    assert root.add_folder("f1").path == "/f1"
+
+
 def test_find_by_path(db):
     root = Folder.get_root()
 
@@ -170,6 +306,25 @@ def test_find_by_path(db):
     assert Folder.find_by_path("f4", f2) == f4
     assert Folder.find_by_path("../f4", f3) == f4
     assert Folder.find_by_path("../f3", f4) == f3
+    assert Folder.find_by_path("f2/../f2/./f3", f1) == f3
+    assert Folder.find_by_path("/f1/../f1/f2/f4") == f4
+    assert Folder.find_by_path("/..") is None
+    assert Folder.find_by_path("../..", f1) is None
+
+
+def test_find_by_path_single_query(db):
+    root = Folder.get_root()
+    f = root
+    for i in range(10):
+        f = f.add_folder(f"f{i}")
+    f5 = Folder.find_by_path("/f0/f1/f2/f3/f4/f5")
+
+    with patch.object(database, "execute_sql", wraps=database.execute_sql) as ex:
+        assert Folder.find_by_path("/f0/f1/f2/f3/f4/f5/f6/f7/f8/f9") == f
+        assert ex.call_count == 1
+    with patch.object(database, "execute_sql", wraps=database.execute_sql) as ex:
+        assert Folder.find_by_path("../f5/f6/f7/f8/f9", f5) == f
+        assert ex.call_count == 1
 
 
 def test_fancy_operator(db):
@@ -186,7 +341,7 @@ def test_fancy_operator(db):
     assert root / "f1" / "f2" / "f4" == f4
 
 
-def test_folders_recursive(db, state, monkeypatch, sqlite_version):
+def test_folders_recursive(db, state):
     root = Folder.get_root()
     f1 = root.add_folder("f1")
     f2 = f1.add_folder("f2")
@@ -196,13 +351,57 @@ def test_folders_recursive(db, state, monkeypatch, sqlite_version):
     folders = root.folders_recursive()
     assert set(folders) == set([f1, f2, f3, f4])
 
-    with monkeypatch.context() as m:
-        m.setattr("sqlite3.sqlite_version_info", (3, 7, 17))
-        folders = root.folders_recursive()
-        assert set(folders) == set([f1, f2, f3, f4])
+    ids = set(f.folder_id for f in [f1, f2, f3, f4])
+    assert set(root.folders_recursive_ids()) == ids
+    assert set(f1.folders_recursive_ids()) == {f2.folder_id, f3.folder_id}
+    assert list(f4.folders_recursive_ids()) == []
+
 
+def test_recursive_deep(db, state):
+    root = Folder.get_root()
+    f = root
+    folders = []
+    for i in range(50):
+        f = f.add_folder(f"f{i}")
+        folders.append(f)
+    root.add_folder("other")
+    with state.pushd(f):
+        j1 = state.create_job(command="sleep 1")
+    with state.pushd(folders[0]):
+        j2 = state.create_job(command="sleep 1")
 
-def test_jobs_recursive(db, state, monkeypatch, sqlite_version):
+    with patch.object(database, "execute_sql", wraps=database.execute_sql) as ex:
+        assert set(folders[0].folders_recursive()) == set(folders[1:])
+        assert ex.call_count == 1
+    with patch.object(database, "execute_sql", wraps=database.execute_sql) as ex:
+        assert set(folders[0].jobs_recursive()) == {j1, j2}
+        assert ex.call_count == 1
+    assert list(folders[1].jobs_recursive()) == [j1]
+
+
+def test_recursive_cte_uses_indexes(db):
+    indexes = {i.name: i.columns for i in database.get_indexes("folder")}
+    assert indexes["folder_parent_id"] == ["parent_id"]
+    indexes = {i.name: i.columns for i in database.get_indexes("job")}
+    assert indexes["job_folder_id"] == ["folder_id"]
+
+    sql = """
+    EXPLAIN QUERY PLAN
+    WITH RECURSIVE
+      children(n) AS (
+        VALUES(1)
+        UNION
+        SELECT folder_id FROM folder, children
+         WHERE folder.parent_id=children.n
+      )
+    SELECT * FROM job where folder_id in children;
+    """
+    plan = " ".join(row[-1] for row in database.execute_sql(sql))
+    assert "folder_parent_id" in plan
+    assert "job_folder_id" in plan
+
+
+def test_jobs_recursive(db, state):
     root = Folder.get_root()
     f1 = root.add_folder("f1")
     f2 = f1.add_folder("f2")
@@ -216,6 +415,64 @@ def test_jobs_recursive(db, state, monkeypatch, sqlite_version):
     assert len(jobs) == 2
     assert all(a == b for a, b in zip(jobs, [j1, j2]))
 
+    j2.status = Job.Status.FAILED
+    j2.save()
+    assert list(root.jobs_recursive(status=Job.Status.FAILED)) == [j2]
+    assert list(root.jobs_recursive(status=Job.Status.CREATED)) == [j1]
+    assert list(f2.jobs_recursive(status=Job.Status.CREATED)) == []
+    j2.status = Job.Status.CREATED
+    j2.save()
+
+    f3 = root.add_folder("f3")
+    jobs = Folder.jobs_recursive_bulk(
+        [root.folder_id, f1.folder_id, f2.folder_id, f3.folder_id]
+    )
+    assert jobs == {
+        root.folder_id: [j1, j2],
+        f1.folder_id: [j1, j2],
+        f2.folder_id: [j2],
+        f3.folder_id: [],
+    }
+    assert jobs == Folder.jobs_recursive_bulk(
+        [root.folder_id, f1.folder_id, f2.folder_id, f3.folder_id], batch_size=1
+    )
+
+    jobs = root.jobs_recursive_with_folder()
+    assert jobs == [j1, j2]
+    with patch.object(database, "execute_sql", wraps=database.execute_sql) as ex:
+        assert [j.folder for j in jobs] == [f1, f2]
+        assert [j.folder.path for j in jobs] == ["/f1", "/f1/f2"]
+        assert ex.call_count == 0
+    assert all(not j.is_dirty() for j in jobs)
+
+
+def test_delete_recursive_bulk(db, state):
+    root = Folder.get_root()
+    f1 = root.add_folder("f1")
+    f2 = f1.add_folder("f2")
+    f3 = root.add_folder("f3")
+    f4 = f3.add_folder("f4")
+    f5 = root.add_folder("f5")
+
+    jobs = {}
+    for f in (f1, f2, f3, f4, f5):
+        with state.pushd(f):
+            jobs[f.name] = state.create_job(command="sleep 1")
+
+    with patch.object(database, "execute_sql", wraps=database.execute_sql) as ex:
+        Folder.delete_recursive_bulk([f1.folder_id, f4.folder_id])
+        deletes = [c for c in ex.call_args_list if "DELETE" in c[0][0]]
+        assert len(deletes) == 2
+
+    assert [f.name for f in root.folders_recursive()] == ["f3", "f5"]
+    assert list(root.jobs_recursive()) == [jobs["f3"], jobs["f5"]]
+    assert Job.select().count() == 2
+
+    Folder.delete_recursive_bulk([f3.folder_id, f5.folder_id], batch_size=1)
+    assert list(root.folders_recursive()) == []
+    assert Job.select().count() == 0
+    assert Folder.get_root() == root
+
 
 def test_job_stats(db, state, monkeypatch):
 
@@ -257,6 +514,33 @@ def test_job_stats(db, state, monkeypatch):
     assert exp == f1.job_stats()
     assert exp == root.job_stats()
 
-    with monkeypatch.context() as m:
-        assert exp == f1.job_stats()
-        assert exp == root.job_stats()
+    stats = Folder.job_stats_bulk([root.folder_id, f1.folder_id, f2.folder_id])
+    assert stats[root.folder_id] == exp
+    assert stats[f1.folder_id] == exp
+    assert stats[f2.folder_id] == f2.job_stats()
+    assert sum(stats[f2.folder_id].values()) == 3
+
+    # batching gives the same result
+    assert stats == Folder.job_stats_bulk(
+        [root.folder_id, f1.folder_id, f2.folder_id], batch_size=1
+    )
+
+    empty = root.add_folder("empty")
+    assert Folder.job_stats_bulk([empty.folder_id]) == {
+        empty.folder_id: {k: 0 for k in Job.Status}
+    }
+    assert Folder.job_stats_bulk([]) == {}
+
+
+def test_get_root_cached(db):
+    root = Folder.get_root()
+    with patch.object(Folder, "get_or_none") as get_or_none:
+        assert Folder.get_root() is root
+        assert Folder.find_by_path("/") is root
+        get_or_none.assert_not_called()
+
+    # a new connection fetches the root again
+    database.close()
+    database.connect()
+    database.create_tables([Folder])
+    assert Folder.get_root() is not root
@@ -8,7 +8,7 @@ from kong import config
 from kong.drivers.local_driver import LocalDriver
 import kong.drivers
 from kong.drivers import DriverMismatch
-from kong.model.job import Job
+from kong.model.job import Job, color_dict, status_color
 from kong.model.folder import Folder
 import peewee as pw
 
@@ -55,6 +55,40 @@ def test_properties(tree):
     assert j1.output_dir == "OUTPUT_PATH"
 
 
+def test_driver_field_cache(tree, monkeypatch):
+    j1 = Job.create(batch_job_id=42, folder=tree, command="a", driver=LocalDriver)
+    name = "kong.drivers.local_driver.LocalDriver"
+    field = Job._meta.fields["driver"]
+    assert field.db_value(LocalDriver) == name
+    assert field.python_value(name) is LocalDriver
+
+    import_module = Mock(side_effect=AssertionError("should be cached"))
+    monkeypatch.setattr("importlib.import_module", import_module)
+    assert Job.get_by_id(j1.job_id).driver is LocalDriver
+    import_module.assert_not_called()
+
+    with pytest.raises(AssertionError):
+        field.db_value(int)
+
+
+def test_status_field(tree):
+    j1 = Job.create(batch_job_id=42, folder=tree, command="a", driver=LocalDriver)
+    j1.status = Job.Status.RUNNING
+    j1.save()
+
+    j1 = Job.get_by_id(j1.job_id)
+    assert j1.status is Job.Status.RUNNING
+    (status,) = Job.select(Job.status).where(Job.job_id == j1.job_id).tuples().get()
+    assert status is Job.Status.RUNNING
+
+
+def test_status_color():
+    for status in Job.Status:
+        assert status_color(status) == color_dict[status]
+    assert status_color(Job.Status.UNKNOWN) == "magenta"
+    assert status_color(Job.Status.CREATED) == "white"
+
+
 def test_set_driver(state, monkeypatch):
     j1 = Job.create(
         batch_job_id=42, folder=state.cwd, command="sleep 2", driver=LocalDriver
@@ -182,6 +216,11 @@ def test_stdout_stderr(job):
     with job.stderr() as f:
         assert f.read() == "2TESTVALUE2"
 
+    # the driver's context manager is passed through as is
+    cm = object()
+    job._driver_instance = Mock(stdout=Mock(return_value=cm))
+    assert job.stdout() is cm
+
 
 def test_kill(job):
     driver = Mock()
@@ -1,5 +1,7 @@
 import os
 import re
+import signal
+import subprocess
 import tempfile
 import time
 from concurrent.futures import Executor, Future
@@ -15,9 +17,16 @@ from conftest import skip_lxplus
 
 from kong.model import BaseModel
 from kong.model.folder import Folder
-from kong.model.job import Job
-
-from kong.repl import Repl, complete_path
+from kong.model.job import Job, status_color
+
+from kong.repl import (
+    Repl,
+    complete_path,
+    style_status,
+    to_local_time,
+    format_datetime,
+    format_time,
+)
 import kong
 
 import logging
@@ -34,6 +43,79 @@ def repl(state):
     return r
 
 
+def test_parse_arguments_orig_fn():
+    orig = Repl.do_ls.__orig_fn__
+    assert orig.__name__ == "do_ls"
+    assert orig.__doc__ == Repl.do_ls.__doc__
+
+
+def test_parse_arguments_defaults(repl, monkeypatch):
+    # without arguments, the defaults are passed without going through click
+    make_context = MagicMock()
+    monkeypatch.setattr("click.Command.make_context", make_context)
+    monkeypatch.setattr(repl.state, "ls", Mock(return_value=([], [])))
+    repl.onecmd("ls")
+    make_context.assert_not_called()
+    repl.state.ls.assert_called_once_with("", recursive=False, status=None)
+
+    repl.onecmd("ls -r")
+    make_context.assert_called_once()
+
+
+def test_parse_arguments_help(repl, capsys, monkeypatch):
+    repl.onecmd("ls -h")
+    out, err = capsys.readouterr()
+    assert "Usage: ls [OPTIONS] [DIR]" in out
+    assert "--show-sizes" in out
+
+    ls = Mock(side_effect=KeyboardInterrupt())
+    monkeypatch.setattr(repl.state, "ls", ls)
+    with pytest.raises(click.Abort):
+        repl.do_ls(".")
+
+
+def test_to_local_time(monkeypatch):
+    import dateutil.tz
+
+    monkeypatch.setenv("TZ", "Europe/Zurich")
+    time.tzset()
+    try:
+        for dt in (
+            datetime(2021, 1, 15, 12, 30),
+            datetime(2021, 7, 15, 12, 30),
+            datetime(2021, 3, 28, 0, 59),
+            datetime(2021, 3, 28, 1, 0),
+        ):
+            exp = dt.replace(tzinfo=dateutil.tz.tzutc()).astimezone(
+                dateutil.tz.tzlocal()
+            )
+            act = to_local_time(dt)
+            assert act == exp
+            assert act.strftime("%Y-%m-%d %H:%M:%S") == exp.strftime(
+                "%Y-%m-%d %H:%M:%S"
+            )
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_format_datetime():
+    for dt in (
+        datetime(2021, 3, 4, 5, 6, 7, 123),
+        datetime(1999, 12, 31, 23, 59, 59),
+        to_local_time(datetime(2021, 7, 15, 12, 30)),
+    ):
+        assert format_datetime(dt) == dt.strftime("%Y-%m-%d %H:%M:%S")
+        assert format_time(dt) == dt.strftime("%H:%M:%S")
+
+
+def test_style_status():
+    for status in Job.Status:
+        exp = click.style("text", fg=status_color(status))
+        assert style_status("text", status) == exp
+    assert style_status(42, Job.Status.FAILED) == click.style("42", fg="red")
+
+
 def test_ls(tree, state, repl, capsys, sample_jobs, monkeypatch):
     repl.do_ls(".")
     out, err = capsys.readouterr()
@@ -213,6 +295,56 @@ f3   0 bytes                        0       0         0       0      0         0
     ]
     assert "\n".join(lines[:6]).strip() == exp
 
+    # the pool is kept for subsequent calls
+    pool = repl._io_pool
+    assert isinstance(pool, DirectExecutor)
+    repl.onecmd("ls -s .")
+    assert repl._io_pool is pool
+
+    # jobs listed both directly and below a folder are only sized once
+    capsys.readouterr()
+    size = Mock(return_value=42)
+    monkeypatch.setattr("kong.repl.Job.size", size)
+    repl.onecmd("ls -s -r .")
+    out, err = capsys.readouterr()
+    njobs = Job.select().count()
+    assert len(re.findall("42 bytes", out)) == njobs
+    assert "168 bytes" in out and "252 bytes" in out
+    assert size.call_count == njobs
+
+
+def test_job_size_cache(repl, sample_jobs, monkeypatch):
+    size = Mock(return_value=42)
+    monkeypatch.setattr("kong.repl.Job.size", size)
+    job = sample_jobs[0]
+
+    # unfinished jobs are always sized
+    assert repl._job_size(job) == 42
+    assert repl._job_size(job) == 42
+    assert size.call_count == 2
+
+    job.status = Job.Status.COMPLETED
+    job.save()
+    size.reset_mock()
+    assert repl._job_size(job) == 42
+    assert repl._job_size(job) == 42
+    assert size.call_count == 1
+
+    # an update invalidates the cached value
+    job.save()
+    assert repl._job_size(job) == 42
+    assert size.call_count == 2
+
+
+def test_io_pool(repl, monkeypatch):
+    monkeypatch.setattr("readline.write_history_file", Mock())
+    pool = repl._get_io_pool()
+    assert repl._get_io_pool() is pool
+    repl.postloop()
+    assert repl._io_pool is None
+    with pytest.raises(RuntimeError):
+        pool.submit(print)
+
 
 @skip_lxplus
 def test_ls_refresh(repl, state, capsys, sample_jobs, monkeypatch):
@@ -243,7 +375,7 @@ def test_ls_refresh(repl, state, capsys, sample_jobs, monkeypatch):
         mock = Mock(return_value=[])
         m.setattr(state, "refresh_jobs", mock)
         repl.onecmd("ls -R /")
-        assert mock.call_count == 2  # called once for folders, once for jobs
+        assert mock.call_count == 1  # jobs are only refreshed once
 
 
 def test_complete_path(state, tree, repl):
@@ -262,6 +394,11 @@ def test_complete_path(state, tree, repl):
     alts = complete_path(root.subfolder("f2"), "a")
     assert alts == ["alpha/"]
 
+    # prefix matching is case sensitive
+    root.add_folder("F4")
+    assert complete_path(root, "f") == ["f1/", "f2/", "f3/"]
+    assert complete_path(root, "F") == ["F4/"]
+
 
 def test_completed_default(repl):
     root = Folder.get_root()
@@ -279,6 +416,20 @@ def test_completed_default(repl):
     assert repl.completedefault("be", "ls be", 3, 5) == ["beta_delta/", "beta_gamma/"]
 
 
+def test_complete_path_cache(state, repl):
+    root = Folder.get_root()
+    root.add_folder("alpha")
+
+    assert repl.completedefault("a", "ls a", 3, 4) == ["alpha/"]
+
+    # folders created behind the repl's back are not seen until the next command
+    root.add_folder("another")
+    assert repl.completedefault("a", "ls a", 3, 4) == ["alpha/"]
+
+    repl.onecmd("mkdir avocado")
+    assert repl.completedefault("a", "ls a", 3, 4) == ["alpha/", "another/", "avocado/"]
+
+
 def test_mkdir(state, repl, db, capsys, monkeypatch):
     root = Folder.get_root()
     sub = root.add_folder("sub")
@@ -711,17 +862,107 @@ def test_exit(repl):
 
 
 def test_preloop(repl, monkeypatch):
+    monkeypatch.setattr(repl, "_use_readline", True)
     m = Mock()
+    set_length = Mock()
+    add = Mock()
     monkeypatch.setattr("readline.read_history_file", m)
-    monkeypatch.setattr("os.path.exists", Mock(return_value=True))
+    monkeypatch.setattr("readline.set_history_length", set_length)
+    monkeypatch.setattr("readline.add_history", add)
+    monkeypatch.setattr("readline.get_current_history_length", Mock(return_value=7))
+    monkeypatch.setattr(repl.state.config, "history_length", 5)
+    monkeypatch.setattr("readline.__doc__", "GNU readline")
+
+    with open(kong.repl.history_file, "w") as fh:
+        fh.write("\n".join(f"cmd {i}" for i in range(20)) + "\n")
+
+    repl.preloop()
+    m.assert_not_called()
+    # only the lines that would be kept are loaded
+    assert [c[0][0] for c in add.call_args_list] == [f"cmd {i}" for i in range(15, 20)]
+    set_length.assert_called_once_with(5)
+    assert repl._history_saved_length == 7
+
+    add.reset_mock()
+    monkeypatch.setattr("readline.__doc__", "libedit")
     repl.preloop()
     m.assert_called_once()
+    add.assert_not_called()
+
     monkeypatch.setattr("os.path.exists", Mock(return_value=False))
     repl.preloop()
 
 
 def test_postloop(state, repl, monkeypatch):
+    monkeypatch.setattr(repl, "_use_readline", True)
+    write = Mock()
+    monkeypatch.setattr("readline.write_history_file", write)
+    repl.postloop()
+    write.assert_called_once_with(kong.repl.history_file)
+
+
+def test_no_tty_skips_history(state, monkeypatch):
+    monkeypatch.setattr("sys.stdin.isatty", lambda: False)
+    repl = Repl(state)
+    write = Mock()
+    read = Mock()
+    set_length = Mock()
+    monkeypatch.setattr("readline.write_history_file", write)
+    monkeypatch.setattr("readline.read_history_file", read)
+    monkeypatch.setattr("readline.set_history_length", set_length)
+    monkeypatch.setattr("cmd.Cmd.onecmd", Mock(return_value=False))
+
+    repl.preloop()
+    repl.onecmd("whatever")
     repl.postloop()
+    write.assert_not_called()
+    read.assert_not_called()
+    set_length.assert_not_called()
+
+    monkeypatch.setattr("sys.stdin.isatty", lambda: True)
+    assert Repl(state)._use_readline
+
+
+def test_history_append(repl, monkeypatch):
+    monkeypatch.setattr(repl, "_use_readline", True)
+    length = 3
+    write = Mock()
+
+    def append_file(n, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+
+    append = Mock(side_effect=append_file)
+    monkeypatch.setattr("readline.get_current_history_length", lambda: length)
+    monkeypatch.setattr("readline.write_history_file", write)
+    monkeypatch.setattr("readline.append_history_file", append, raising=False)
+    monkeypatch.setattr("cmd.Cmd.onecmd", Mock(return_value=False))
+    monkeypatch.setattr(repl, "history_rewrite_interval", 3)
+
+    # no history file yet: write it fully
+    repl.onecmd("whatever")
+    write.assert_called_once()
+    append.assert_called_once()
+
+    with open(kong.repl.history_file, "w"):
+        pass
+    write.reset_mock()
+    append.reset_mock()
+
+    length = 4
+    repl.onecmd("whatever")
+    append.assert_called_once_with(1, kong.repl.history_file)
+    append.reset_mock()
+    # nothing new
+    repl.onecmd("whatever")
+    append.assert_not_called()
+    write.assert_not_called()
+
+    # every n commands, rewrite to truncate
+    length = 5
+    repl.onecmd("whatever")
+    append.assert_not_called()
+    write.assert_called_once()
 
 
 def test_precmd(repl):
@@ -730,15 +971,22 @@ def test_precmd(repl):
 
 
 def test_onecmd(repl, monkeypatch, capsys):
+    monkeypatch.setattr(repl, "_use_readline", True)
     set_length = Mock()
     write = Mock()
     monkeypatch.setattr("readline.set_history_length", set_length)
     monkeypatch.setattr("readline.write_history_file", write)
+    monkeypatch.setattr(
+        "readline.append_history_file",
+        Mock(side_effect=FileNotFoundError()),
+        raising=False,
+    )
+    monkeypatch.setattr("readline.get_current_history_length", Mock(return_value=1))
     m = Mock(return_value="ok")
     monkeypatch.setattr("cmd.Cmd.onecmd", m)
     assert repl.onecmd("whatever") == "ok"
-    set_length.assert_called_once_with(repl.state.config.history_length)
-    write.assert_called_once()
+    set_length.assert_not_called()
+    write.assert_called_once()  # no history file yet
     m.assert_called_once()
 
     m = Mock(side_effect=TypeError("MESSAGE"))
@@ -829,6 +1077,18 @@ def test_create_job_extra_arguments(repl, state, tree, monkeypatch):
     assert kwargs["ARGB"] == "blurz"
     assert kwargs["ARGC"] == 42
 
+    # only the first = separates name and value
+    state.create_job.reset_mock()
+    repl.onecmd(f"create_job -a ARGA=a=b -a ARGB= '{cmd}'")
+    kwargs = state.create_job.call_args[1]
+    assert kwargs["ARGA"] == "a=b"
+    assert kwargs["ARGB"] == ""
+
+    state.create_job.reset_mock()
+    with pytest.raises(UsageError):
+        repl.onecmd(f"create_job -a ARGA '{cmd}'")
+    assert state.create_job.call_count == 0
+
 
 @skip_lxplus
 def test_submit_job(repl, state, capsys, monkeypatch):
@@ -1004,9 +1264,17 @@ def test_info(state, repl, capsys, monkeypatch):
 def test_tail(state, repl, capsys, monkeypatch):
     job = state.create_job(command="sleep 1")
 
+    def make_popen():
+        proc = Mock()
+        r, w = os.pipe()
+        os.write(w, b"line 1\nline 2\n")
+        os.close(w)
+        proc.stdout = os.fdopen(r, "rb")
+        return Mock(return_value=proc)
+
     with monkeypatch.context() as m:
-        tail = Mock()
-        m.setattr("sh.tail", tail)
+        popen = make_popen()
+        m.setattr("subprocess.Popen", popen)
         m.setattr("time.sleep", Mock())
 
         res = iter([False, False, True])
@@ -1021,11 +1289,16 @@ def test_tail(state, repl, capsys, monkeypatch):
         repl.onecmd(f"tail {job.job_id}")
         out, err = capsys.readouterr()
         spinner.assert_called_once()
-        assert tail.call_count == 1
+        popen.assert_called_once_with(
+            ["tail", "-n", "20", "-f", job.data["stdout"]], stdout=subprocess.PIPE
+        )
+        assert "line 1\nline 2\n" in out
+        popen.return_value.terminate.assert_called_once()
+        popen.return_value.wait.assert_called_once()
 
     with monkeypatch.context() as m:
-        tail = Mock()
-        m.setattr("sh.tail", tail)
+        popen = make_popen()
+        m.setattr("subprocess.Popen", popen)
 
         def exists(f):
             if f == job.data["stdout"]:
@@ -1034,10 +1307,11 @@ def test_tail(state, repl, capsys, monkeypatch):
         m.setattr("os.path.exists", Mock(side_effect=exists))
         spinner = MagicMock()
         m.setattr("kong.repl.Spinner", spinner)
-        repl.onecmd(f"tail {job.job_id}")
+        repl.onecmd(f"tail -n 5 {job.job_id}")
         out, err = capsys.readouterr()
         assert spinner.call_count == 0
-        assert tail.call_count == 1
+        assert popen.call_count == 1
+        assert popen.call_args[0][0][:3] == ["tail", "-n", "5"]
 
     with pytest.raises(UsageError):
         repl.onecmd(f"tail --nope")
@@ -1069,6 +1343,20 @@ def test_less(state, repl, capsys, monkeypatch):
             pager.assert_called_once()
             assert "".join(lines) == content
 
+    # large files are passed in blocks, multi-byte characters stay intact
+    content = "äöü line\n" * 20000
+    with tempfile.NamedTemporaryFile("wt", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        job.data["stdout"] = f.name
+        job.save()
+
+        with monkeypatch.context() as m:
+            m.setattr("click.echo_via_pager", Mock(side_effect=agg))
+            repl.onecmd(f"less {job.job_id}")
+            assert "".join(lines) == content
+            assert len(lines) < 10
+
     with pytest.raises(UsageError):
         repl.onecmd(f"less --nope")
     out, err = capsys.readouterr()
@@ -1079,10 +1367,18 @@ def test_shell(repl, monkeypatch):
     string = "HALLO HALLO 123"
     cmd = f"echo '{string}'"
 
-    run = Mock()
-    monkeypatch.setattr("subprocess.run", run)
+    popen = Mock()
+    monkeypatch.setattr("subprocess.Popen", popen)
+    repl.onecmd(f"!{cmd}")
+    popen.assert_called_once_with(cmd, shell=True, env=ANY)
+    popen.return_value.wait.assert_called_once()
+
+    # interrupting the command does not leave the repl
+    popen.reset_mock()
+    popen.return_value.wait.side_effect = [KeyboardInterrupt(), 0]
     repl.onecmd(f"!{cmd}")
-    run.assert_called_once_with(cmd, shell=True, env=ANY)
+    popen.return_value.send_signal.assert_called_once_with(signal.SIGINT)
+    assert popen.return_value.wait.call_count == 2
 
 
 def test_set_verbosity(repl, monkeypatch):
@@ -16,6 +16,7 @@ from kong.model.folder import Folder
 from kong.model.job import Job
 import kong.drivers
 from kong.state import DoesNotExist, CannotCreateError, CannotRemoveIsFolder
+from kong.state import _count_statuses
 from kong.util import exhaust
 
 
@@ -46,17 +47,22 @@ def test_init(cfg, db):
 
 def test_get_instance(cfg, monkeypatch):
     orig_init = kong.db.database.init
-    init = Mock(side_effect=lambda _: orig_init(":memory:"))
+    init = Mock(side_effect=lambda _, **kwargs: orig_init(":memory:", **kwargs))
     monkeypatch.setattr("kong.db.database.init", init)
     s = kong.state.State.get_instance()
     assert s is not None
     init.assert_called_once()
+    assert init.call_args[1]["pragmas"] == kong.db.pragmas
+    assert init.call_args[1]["cached_statements"] == kong.db.cached_statements
+    # temp_store=memory is 2
+    assert kong.db.database.execute_sql("PRAGMA temp_store").fetchone()[0] == 2
+    assert kong.db.database.execute_sql("PRAGMA cache_size").fetchone()[0] == -65536
     assert s.cwd == kong.model.folder.Folder.get_root()
 
 
 def test_module_get_instance(cfg, monkeypatch):
     orig_init = kong.db.database.init
-    init = Mock(side_effect=lambda _: orig_init(":memory:"))
+    init = Mock(side_effect=lambda _, **kwargs: orig_init(":memory:", **kwargs))
     monkeypatch.setattr("kong.db.database.init", init)
     s = kong.get_instance()
     assert s is not None
@@ -81,7 +87,7 @@ def test_ls(tree, state, sample_jobs):
     assert all(a == b for a, b in zip(jobs, f2.jobs))
 
 
-def test_ls_recursive_no_children(state, monkeypatch, sqlite_version):
+def test_ls_recursive_no_children(state):
     root = Folder.get_root()
     f1 = root.add_folder("f1")
     with state.pushd(f1):
@@ -100,7 +106,7 @@ def test_ls_recursive_no_children(state, monkeypatch, sqlite_version):
     assert jobs == jobs2
 
 
-def test_ls_recursive_with_children(state, monkeypatch, sqlite_version):
+def test_ls_recursive_with_children(state):
     root = Folder.get_root()
     with state.pushd(root):
         jobs0 = [state.create_job(command="sleep 1") for _ in range(10)]
@@ -121,6 +127,35 @@ def test_ls_recursive_with_children(state, monkeypatch, sqlite_version):
     assert jobs == jobs2
 
 
+def test_ls_status(state):
+    root = Folder.get_root()
+    with state.pushd(root):
+        jobs0 = [state.create_job(command="sleep 1") for _ in range(4)]
+    f1 = root.add_folder("f1")
+    with state.pushd(f1):
+        jobs1 = [state.create_job(command="sleep 1") for _ in range(4)]
+
+    for job in jobs0[:2] + jobs1[:1]:
+        job.status = Job.Status.FAILED
+        job.save()
+
+    _, jobs = state.ls("/", status=Job.Status.FAILED)
+    assert jobs == jobs0[:2]
+    _, jobs = state.ls("/", status=Job.Status.CREATED)
+    assert jobs == jobs0[2:]
+    _, jobs = state.ls("/", recursive=True, status=Job.Status.FAILED)
+    assert jobs == jobs0[:2] + jobs1[:1]
+    _, jobs = state.ls("/", status=Job.Status.COMPLETED)
+    assert jobs == []
+
+    # filtered after the refresh, since it might change the status
+    refresh = Mock(side_effect=lambda jobs: jobs)
+    state.refresh_jobs = refresh
+    _, jobs = state.ls("/", refresh=True, status=Job.Status.FAILED)
+    assert len(refresh.call_args[0][0]) == 4
+    assert jobs == jobs0[:2]
+
+
 @skip_lxplus
 def test_ls_refresh(tree, state, sample_jobs):
     _, jobs = state.ls(".")
@@ -226,6 +261,106 @@ def test_refresh_jobs(state, sample_jobs, monkeypatch):
     )
 
 
+def test_refresh_jobs_per_driver(state, monkeypatch):
+    driver = ValidDriver(state.config)
+    jobs = [
+        state.default_driver.create_job(command="sleep 0.1", folder=state.cwd),
+        driver.create_job(command="sleep 0.1", folder=state.cwd),
+        state.default_driver.create_job(command="sleep 0.1", folder=state.cwd),
+    ]
+
+    calls = []
+
+    def bulk_sync_status(self, jobs):
+        calls.append((self.__class__, [j.job_id for j in jobs]))
+        return list(reversed(jobs))
+
+    monkeypatch.setattr(LocalDriver, "bulk_sync_status", bulk_sync_status)
+    get_status = Mock()
+    monkeypatch.setattr(Job, "get_status", get_status)
+
+    refreshed = state.refresh_jobs(jobs)
+    assert get_status.call_count == 0
+    assert sorted(calls, key=lambda c: c[0].__name__) == [
+        (LocalDriver, [jobs[0].job_id, jobs[2].job_id]),
+        (ValidDriver, [jobs[1].job_id]),
+    ]
+    # input order is kept
+    assert refreshed == jobs
+
+
+def test_refresh_jobs_mismatch_fallback(state, monkeypatch):
+    jobs = [state.create_job(command="sleep 0.1") for _ in range(3)]
+    calls = []
+
+    def bulk_sync_status(self, jobs):
+        calls.append([j.job_id for j in jobs])
+        if len(calls) == 1:
+            raise kong.drivers.DriverMismatch()
+        return jobs
+
+    monkeypatch.setattr(LocalDriver, "bulk_sync_status", bulk_sync_status)
+    get_status = Mock()
+    monkeypatch.setattr(Job, "get_status", get_status)
+
+    assert state.refresh_jobs(jobs) == jobs
+    # retried in bulk, not job by job
+    assert calls == [[j.job_id for j in jobs]] * 2
+    assert get_status.call_count == 0
+
+
+def test_ensure_driver_shared(state, monkeypatch):
+    driver = ValidDriver(state.config)
+    local_job = state.default_driver.create_job(command="sleep 1", folder=state.cwd)
+    valid_jobs = [
+        driver.create_job(command="sleep 1", folder=state.cwd) for _ in range(3)
+    ]
+    # fresh instances from the database carry no driver instance
+    local_job = Job.get_by_id(local_job.job_id)
+    valid_jobs = [Job.get_by_id(j.job_id) for j in valid_jobs]
+
+    assert state._ensure_driver(local_job) is state.default_driver
+
+    init = Mock(return_value=None)
+    monkeypatch.setattr(ValidDriver, "__init__", init)
+    instances = [state._ensure_driver(j) for j in valid_jobs]
+    assert init.call_count == 1
+    assert all(i is instances[0] for i in instances)
+    assert isinstance(instances[0], ValidDriver)
+    assert all(j.driver_instance is instances[0] for j in valid_jobs)
+
+
+def test_default_driver_lazy(state):
+    s = kong.state.State(state.config, Folder.get_root())
+    assert s._default_driver is None
+    s.mkdir("a")
+    s.ls("a")
+    assert s._default_driver is None
+
+    driver = s.default_driver
+    assert isinstance(driver, LocalDriver)
+    assert s.default_driver is driver
+    job = s.create_job(command="sleep 1")
+    assert s._ensure_driver(Job.get_by_id(job.job_id)) is driver
+
+
+def test_jobs_recursive_multiple_folders(state):
+    root = Folder.get_root()
+    f1 = root.add_folder("f1")
+    f2 = f1.add_folder("f2")
+    f3 = root.add_folder("f3")
+    with state.pushd(f2):
+        jobs2 = [state.create_job(command="sleep 1") for _ in range(2)]
+    with state.pushd(f1):
+        jobs1 = [state.create_job(command="sleep 1") for _ in range(2)]
+    with state.pushd(f3):
+        jobs3 = [state.create_job(command="sleep 1") for _ in range(2)]
+
+    assert state._jobs_recursive([f3, f1]) == jobs3 + jobs2 + jobs1
+    assert state._jobs_recursive([f2, f1]) == jobs2 + jobs2 + jobs1
+    assert state._jobs_recursive([]) == []
+
+
 def test_cd(state):
     root = Folder.get_root()
     assert state.cwd == root
@@ -323,6 +458,25 @@ def test_mv_folder(state, db):
         state.mv("../nope", f1)
 
 
+def test_mv_folder_paths(state, db):
+    root = Folder.get_root()
+    f1, f2, f3 = [root.add_folder(n) for n in ("f1", "f2", "f3")]
+    sub = f1.add_folder("sub")
+    subsub = sub.add_folder("subsub")
+
+    state.cd(subsub)
+    state.mv("/f1", f2)
+    assert state.cwd.path == "/f2/f1/sub/subsub"
+    assert Folder.find_by_path("/f2/f1/sub/subsub") == subsub
+
+    # bulk move via glob
+    state.cd("/")
+    state.mv("f2/*", "f3")
+    subsub.reload()
+    assert subsub.path == "/f3/f1/sub/subsub"
+    assert Folder.find_by_path("/f3/f1/sub") == sub
+
+
 def test_mv_job(state, db):
     root = Folder.get_root()
 
@@ -516,6 +670,10 @@ def test_get_folders_pattern(state):
     assert len(globbed_beta) == len(folders_beta)
     assert all(a == b for a, b in zip(globbed_beta, folders_beta))
 
+    assert state.get_folders("?lpha_[2-4]*") == folders_alpha[2:5]
+    assert state.get_folders("beta_[!0-7]*") == folders_beta[8:]
+    assert state.get_folders("Alpha_*") == []
+
 
 def test_mkdir(state, db):
     root = Folder.get_root()
@@ -593,6 +751,12 @@ def test_mkdir_create_parent(state):
     state.mkdir("/basic2", create_parent=True)
     assert Folder.find_by_path("/basic2", state.cwd) is not None
 
+    # only the missing part of the path is created, relative to cwd
+    state.cd("/a1/b2")
+    state.mkdir("c3/x/./y/z", create_parent=True)
+    assert Folder.find_by_path("/a1/b2/c3/x/y/z") is not None
+    assert len(Folder.find_by_path("/a1/b2").children) == 1
+
 
 def test_rm_folder(state, db):
     root = Folder.get_root()
@@ -817,6 +981,14 @@ def test_get_jobs_range(state):
     with pytest.raises(ValueError):
         state.get_jobs("4..2")
 
+    # only jobs in the given folder are selected
+    state.mkdir("sub")
+    state.cd("sub")
+    f6 = state.create_job(command="sleep 1")
+    state.cd("..")
+    assert set(state.get_jobs("2..6")) == set([f2, f3, f4, f5])
+    assert state.get_jobs("sub/2..6") == [f6]
+
 
 def test_submit_job(state, db):
     root = Folder.get_root()
@@ -1005,6 +1177,34 @@ def test_job_resubmit_failed_only(state):
     assert j3.status == Job.Status.SUBMITTED
 
 
+def test_no_jobs_selected(state, monkeypatch):
+    state.mkdir("empty")
+    confirm = Mock(return_value=True)
+    init = Mock(side_effect=RuntimeError("driver constructed"))
+    monkeypatch.setattr(LocalDriver, "__init__", init)
+
+    state.submit_job("empty", confirm=confirm)
+    state.kill_job("empty", confirm=confirm)
+    state.resubmit_job("empty", confirm=confirm)
+    state.wait(["empty"], notify=False)
+
+    assert confirm.call_count == 0
+    assert init.call_count == 0
+
+
+def test_count_statuses():
+    jobs = [
+        Mock(status=s)
+        for s in (Job.Status.FAILED, Job.Status.RUNNING, Job.Status.FAILED)
+    ]
+    counts = _count_statuses(jobs)
+    assert list(counts.keys()) == list(Job.Status)
+    assert counts[Job.Status.FAILED] == 2
+    assert counts[Job.Status.RUNNING] == 1
+    assert sum(counts.values()) == 3
+    assert _count_statuses([]) == {k: 0 for k in Job.Status}
+
+
 def test_wait(state, monkeypatch):
     root = Folder.get_root()
     j1 = state.create_job(command="sleep 0.1")
@@ -1117,6 +1317,60 @@ def test_wait_timeout(state, monkeypatch):
         assert nm.notify.call_count == 1
 
 
+def test_wait_final_sync(state, monkeypatch):
+    j1 = state.create_job(command="sleep 0.1")
+    j2 = state.create_job(command="sleep 0.1")
+
+    j1.status = Job.Status.COMPLETED
+    j2.status = Job.Status.RUNNING
+
+    def bulk_sync_status(jobs):
+        for job in jobs:
+            job.status = Job.Status.FAILED
+        return jobs
+
+    driver = Mock()
+    driver.wait = Mock(return_value=iter([[j1, j2]]))
+    driver.bulk_sync_status = Mock(side_effect=bulk_sync_status)
+    factory = Mock(return_value=driver)
+    monkeypatch.setattr("kong.drivers.local_driver.LocalDriver", factory)
+    monkeypatch.setattr("kong.state.Spinner", MagicMock())
+
+    nm = MagicMock()
+    monkeypatch.setattr(state.config, "notifications", nm)
+    state.wait("*", notify=True, poll_interval=0.1)
+
+    # only the job unfinished at the last poll is synced again
+    driver.bulk_sync_status.assert_called_once_with([j2])
+    assert "FAILURE" in nm.notify.mock_calls[0][2]["title"]
+    assert "C1" in nm.notify.mock_calls[0][2]["message"]
+
+
+def test_wait_jobspecs(state, monkeypatch):
+    j1 = state.create_job(command="sleep 0.1")
+    j2 = state.create_job(command="sleep 0.1")
+    j3 = state.create_job(command="sleep 0.1")
+
+    driver = Mock()
+    driver.wait = Mock(return_value=iter([]))
+    driver.bulk_sync_status = Mock(side_effect=lambda jobs: jobs)
+    factory = Mock(return_value=driver)
+    monkeypatch.setattr("kong.drivers.local_driver.LocalDriver", factory)
+    monkeypatch.setattr("kong.state.Spinner", MagicMock())
+
+    with monkeypatch.context() as m:
+        bulk_select = Mock(wraps=Job.bulk_select)
+        m.setattr(Job, "bulk_select", bulk_select)
+        state.wait([str(j2.job_id), j1.job_id, "*"], notify=False)
+        assert bulk_select.call_count == 1
+
+    # in the order of the specs, every job only once
+    assert driver.wait.call_args[0][0] == [j2, j1, j3]
+
+    with pytest.raises(DoesNotExist):
+        state.wait([j1.job_id, 42], notify=False)
+
+
 def test_wait_failure(state, monkeypatch):
     root = Folder.get_root()
     j1 = state.create_job(command="sleep 0.1")
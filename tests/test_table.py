@@ -182,6 +182,22 @@ nebukadnezar  otto   kilo
     )
 
 
+def test_row_colors():
+    headers = ["alpha", "beta"]
+    rows = [["delta", "omega"], ["echo", "charlie"]]
+    align = ["l", "l"]
+
+    plain = format_table(headers, rows, align)
+    s = format_table(headers, rows, align, row_colors=["red", None])
+    assert unstyle(s) == plain
+
+    lines = s.split("\n")
+    plain_lines = plain.split("\n")
+    assert lines[:2] == plain_lines[:2]
+    assert lines[2] == click.style(plain_lines[2], fg="red")
+    assert lines[3] == plain_lines[3]
+
+
 def test_stretch_shorten():
     headers = ["alpha", "beta", click.style("gamma", bg="green")]
     rows = [
@@ -1,5 +1,6 @@
 import logging
 import os
+import shlex
 import shutil
 import stat
 import subprocess
@@ -23,10 +24,15 @@ from kong.util import (
     make_executable,
     is_executable,
     rmtree,
+    ensure_dir,
+    tail_lines,
+    ShellCommand,
     chunks,
     Spinner,
     Progress,
     get_size,
+    split_args,
+    wait_for_path,
     set_verbosity,
 )
 
@@ -162,6 +168,49 @@ def test_rmtree(monkeypatch):
         assert system.call_count == 0
 
 
+def test_ensure_dir(tmp_path):
+    p = tmp_path / "a"
+    ensure_dir(str(p))
+    assert p.is_dir()
+    ensure_dir(str(p))  # exists already, no error
+    assert p.is_dir()
+
+    p = tmp_path / "b" / "c" / "d"
+    ensure_dir(str(p))
+    assert p.is_dir()
+
+
+def test_tail_lines(tmp_path):
+    p = tmp_path / "file"
+    lines = [f"line {i}" for i in range(1000)]
+    p.write_text("\n".join(lines) + "\n")
+
+    assert tail_lines(str(p), 5) == lines[-5:]
+    # small blocks need several reads
+    assert tail_lines(str(p), 300, block_size=16) == lines[-300:]
+    assert tail_lines(str(p), 2000) == lines
+    assert tail_lines(str(p), 0) == []
+
+    p.write_text("a\nb")  # no trailing newline
+    assert tail_lines(str(p), 1) == ["b"]
+    p.write_text("")
+    assert tail_lines(str(p), 3) == []
+
+
+def test_shell_command():
+    echo = ShellCommand("echo")
+    assert echo("a", 1) == "a 1\n"
+    assert echo(flag=True, other=False, value=5) == "--flag --value=5\n"
+    assert list(echo("a", _iter=True)) == ["a\n"]
+
+    with pytest.raises(subprocess.CalledProcessError):
+        ShellCommand("false")()
+    with pytest.raises(subprocess.CalledProcessError):
+        list(ShellCommand("false")(_iter=True))
+    with pytest.raises(FileNotFoundError):
+        ShellCommand("this_command_does_not_exist_hopefully")
+
+
 def test_chunks():
     l = [1, 2, 3, 4, 5, 6, 7]
     ch = list(chunks(l, 2))
@@ -282,6 +331,42 @@ def cleaned_tmpdir(tmpdir):
     yield sub
 
 
+def test_split_args():
+    for string in [
+        "",
+        "   ",
+        "ls",
+        "ls -s  -r\t--status CREATED some/path/ ",
+        "create_job -a cores=4 -- exe --and # not a comment",
+        "create_job 'sleep 1; echo \"hi\"'",
+        'mv "with space" other',
+        "escaped\\ space",
+        "ls\x0bvertical\x0ctab\u00a0nbsp",
+    ]:
+        assert split_args(string) == shlex.split(string), string
+
+    with pytest.raises(ValueError):
+        split_args("unclosed 'quote")
+
+
+def test_wait_for_path(tmpdir, monkeypatch):
+    path = str(tmpdir / "file")
+    sleeps = []
+
+    def sleep(t):
+        sleeps.append(t)
+        if len(sleeps) == 8:
+            open(path, "w").close()
+
+    monkeypatch.setattr("time.sleep", sleep)
+    wait_for_path(path, initial_interval=0.1, max_interval=1.0)
+    assert sleeps == pytest.approx([0.1, 0.2, 0.4, 0.8, 1.0, 1.0, 1.0, 1.0])
+
+    sleeps.clear()
+    wait_for_path(path)
+    assert sleeps == []
+
+
 def test_get_size(cleaned_tmpdir):
     tmpdir = cleaned_tmpdir
 
@@ -309,6 +394,12 @@ def test_get_size(cleaned_tmpdir):
     with ThreadPoolExecutor() as ex:
         assert get_size(tmpdir, ex) == size
 
+    # symlinks to directories are not followed
+    (tmpdir / "link").symlink_to(B, target_is_directory=True)
+    assert get_size(tmpdir) == size
+
+    assert get_size(tmpdir / "nope") == 0
+
 
 def test_set_verbosity(monkeypatch):
     coloredlogs = Mock()